@@ -1,9 +1,8 @@
 import torch, copy
 from munch import Munch
 
-class BaseParameter(torch.nn.Module):
+class BaseParameter():
     def __init__(self, tensor, parent, name, range, units, locked=False):
-        super(BaseParameter, self).__init__()
         self.parent = parent
         self.name = name
         self.range = range
@@ -33,9 +32,10 @@ class BaseParameter(torch.nn.Module):
         if type(_tensor) is not list:
             _tensor = [_tensor]
         if self.locked:
-            self._tensor = torch.tensor(_tensor, requires_grad=False).to(torch.float)
+            self._tensor = torch.tensor(_tensor, dtype=self.parent.linkage.dtype, requires_grad=False)
         else:
-            self._tensor = torch.nn.Parameter(torch.tensor(_tensor).to(torch.float))
+            self._tensor = torch.nn.Parameter(torch.tensor(_tensor, dtype=self.parent.linkage.dtype))
+        self.parent.linkage.bump_param_version()
         
     @property
     def min(self):
@@ -55,34 +55,46 @@ class BaseParameter(torch.nn.Module):
             return((self.tensor-self.target).pow(2))
         else:
             return(0)
+
+    def constraint_residual(self):
+        if self.is_constrained:
+            return((self.tensor-self.target).view(-1))
+        else:
+            return(torch.zeros(0))
            
     def constrain(self, target):
+        linkage = self.parent.linkage
+        if linkage.use_continuation and linkage.compiled and not self.locked:
+            linkage.continuation(self, target)
+        if not self.is_constrained:
+            linkage.invalidate_structure()
         self.is_constrained = True
         self.target = target
-        self.parent.linkage.update()
+        linkage.update(changed=[self])
         
     def unconstrained(self):
+        if self.is_constrained:
+            self.parent.linkage.invalidate_structure()
         self.is_constrained = False
         self.target = None
         
     def lock(self):
+        self.parent.linkage.invalidate_structure()
         self.locked = True
-        value = copy.deepcopy(self._tensor.tolist())
-        del(self._tensor)
-        self.tensor = value
+        self.tensor = self.tensor.tolist()
     
     def unlock(self):
+        self.parent.linkage.invalidate_structure()
         self.locked = False
-        value = copy.deepcopy(self._tensor.tolist())
-        del(self._tensor)
-        self.tensor = value
+        self.tensor = self.tensor.tolist()
         
-class BaseGeometry(torch.nn.Module):
+class BaseGeometry():
     def __init__(self, linkage, name):
-        super(BaseGeometry, self).__init__()
+        self.id = None
         self.linkage = linkage
         self.name = name
         self.params = Munch({})
+        self.cache = {}
     
     def param_info(self):
         if not self.params.values():
@@ -101,7 +113,7 @@ class BaseGeometry(torch.nn.Module):
         for param in self.params.values():
             if not param.locked:
                 counter += 1
-                label = '{}({})'.format(repr(param.tensor)[:9],repr(param.tensor)[22:])
+                label = 'Parameter({})'.format(repr(param.tensor.detach()))
                 print('\t\t\t', param.name, '=', label, '########## is_constrained:', param.is_constrained)
         if counter == 0:
             print('\t\t\tNone')
@@ -114,6 +126,13 @@ class BaseGeometry(torch.nn.Module):
     
     def E(self):
         raise Exception('Override this method.')
+
+    def residuals(self):
+        raise Exception('Override this method.')
+
+    def get_constraint_residuals(self):
+        residuals = [param.constraint_residual() for param in self.params.values()]
+        return(torch.cat([torch.zeros(0)]+residuals))
     
     def get_free_params(self):
         free_params = []
@@ -123,14 +142,15 @@ class BaseGeometry(torch.nn.Module):
         return(free_params)
     
     def set_parameter(self, param_name, value):
+        param = self.params[param_name]
         if self.linkage.use_manual_params:
-            self.params[param_name].manual.tensor = value
+            param.manual.tensor = value
         else:
-            self.params[param_name].tensor = value
+            param.tensor = value
         if not self.linkage.use_manual_params:
-            self.linkage.config_plot.update()
-        if self.linkage.solve and bool(self.linkage.get_param_dict().values()):
-            self.linkage.update()
+            self.linkage.notify_views('parameter_changed', self.linkage.get_affected([param]))
+        if self.linkage.solve and self.linkage.has_free_params():
+            self.linkage.update(changed=[param])
         
     def lock(self, param_name=None):
         param_names = self.params.keys() if param_name is None else [param_name]
@@ -0,0 +1,838 @@
+import sys, io, os, time, json, inspect, warnings, tracemalloc, argparse, platform, subprocess, tempfile
+import numpy as np
+import torch
+from contextlib import redirect_stdout
+from model import LinkageModel, LinkageView
+from solver import ProgramProblem, levenberg_marquardt
+from study import run_study
+from interference import segment_distance
+
+def build_three_bar_linkage(linkage):
+    A = linkage.add_anchorpoint(at=[2,0,0])
+    D = linkage.add_anchorpoint(at=[-2,0,0])
+    ab = A.add_frompointline(L=2, theta=0)
+    bc = ab.p2.add_frompointline(L=3, theta=135)
+    cd = linkage.add_frompointsline(bc.p2, D)
+    ce = bc.p2.add_frompointline(L=4, theta=0)
+    ef = ce.p2.add_frompointline(L=3, theta=135)
+    fd = linkage.add_frompointsline(ef.p2, D)
+    with linkage.solve_off():
+        cd.constrain_length(L=4)
+        fd.constrain_length(7)
+    return(linkage)
+
+def build_four_bar_linkage(linkage):
+    A = linkage.add_anchorpoint(at=[2,0,0])
+    D = linkage.add_anchorpoint(at=[-2,0,0])
+    ab = A.add_frompointline(L=2, theta=0)
+    bc = ab.p2.add_frompointline(L=3, theta=135)
+    cd = linkage.add_frompointsline(bc.p2, D)
+    with linkage.solve_off():
+        cd.constrain_length(L=4)
+    return(linkage)
+
+def build_linear_to_angular_linkage(linkage):
+    with linkage.solve_off():
+        A = linkage.add_anchorpoint(at=[0,0,0])
+        B = linkage.add_anchorpoint(at=[-2,0,0])
+        C = linkage.add_anchorpoint(at=[2,0,0])
+        bc = linkage.add_frompointsline(B, C)
+        de = A.add_onpointline(L=4, theta=50, beta=0.5)
+        de.params.beta.lock()
+        fg = A.add_onpointline(L=4, theta=100, beta=0.5)
+        fg.params.beta.lock()
+        H = de.add_onlinepoint(alpha=0.75)
+        H.lock()
+        J = fg.add_onlinepoint(alpha=0.75)
+        J.lock()
+        I = bc.add_onlinepoint(alpha=0.8)
+        I.lock()
+        K = de.add_onlinepoint(alpha=0.8)
+        K.lock()
+        hi = linkage.add_frompointsline(H, I)
+        jk = linkage.add_frompointsline(J, K)
+        en = linkage.add_onpointsline(L=4, parent1=de.p2, parent2=C, gamma=0)
+        en.lock()
+        nq = en.p2.add_frompointline(L=4, theta=-90, ux=en)
+        nq.lock()
+        hi.constrain_length(1)
+        jk.constrain_length(1)
+        M = nq.add_onlinepoint(alpha=0.6)
+        lm = M.add_frompointline(L=4, theta=-90, ux=nq)
+        lm.lock()
+        _I = lm.add_onlinepoint(alpha=0.7)
+        _K = lm.add_onlinepoint(alpha=0.9)
+        ii = linkage.add_frompointsline(_I, I)
+        kk = linkage.add_frompointsline(_K, K)
+        I.unlock()
+        K.unlock()
+        ii.constrain_length(0)
+        kk.constrain_length(0)
+    return(linkage)
+
+def build_broadcasting_linkage(linkage):
+    with linkage.solve_off():
+        A = linkage.add_anchorpoint(at=[0,0,0])
+        a = A.add_onpointline(L=1, theta=0, beta=0.5)
+        a.lock('beta')
+        b = A.add_onpointline(L=1, theta=45, beta=0)
+        b.lock('beta')
+        c = linkage.add_frompointsline(a.p2, b.p2)
+        c.constrain_length(0)
+    return(linkage)
+
+def build_chain_linkage(linkage, num_lines):
+    with linkage.solve_off():
+        A = linkage.add_anchorpoint(at=[0,0,0])
+        B = linkage.add_anchorpoint(at=[num_lines/2,0,0])
+        point = A
+        for i in range(num_lines):
+            line = point.add_frompointline(L=1, theta=10*(i%2))
+            point = line.p2
+        closure = linkage.add_frompointsline(point, B)
+        closure.constrain_length(1)
+    return(linkage)
+
+def build_ring_linkage(linkage, num_arms):
+    radius = num_arms/(2*np.pi)
+    with linkage.solve_off():
+        tips = []
+        for i in range(num_arms):
+            angle = 360*i/num_arms
+            A = linkage.add_anchorpoint(at=[radius*np.cos(angle*np.pi/180), radius*np.sin(angle*np.pi/180), 0])
+            arm = A.add_frompointline(L=0.5, theta=angle)
+            arm = arm.p2.add_frompointline(L=0.5, theta=angle+30)
+            tips.append(arm.p2)
+        for i in range(num_arms):
+            linkage.add_frompointsline(tips[i], tips[(i+1) % num_arms]).constrain_length(1)
+    return(linkage)
+
+def get_linkage_factories():
+    factories = {'headless': LinkageModel}
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import geomsolver
+        factories['notebook'] = geomsolver.Linkage
+    except ImportError as error:
+        print('Skipping notebook view: {}'.format(error))
+    return(factories)
+
+def benchmark_views(repeats=3, max_num_epochs=10000):
+    results = {}
+    for label, factory in get_linkage_factories().items():
+        construction, solve = [], []
+        for repeat in range(repeats):
+            with redirect_stdout(io.StringIO()):
+                t0 = time.perf_counter()
+                linkage = build_three_bar_linkage(factory())
+                t1 = time.perf_counter()
+                linkage.update(max_num_epochs=max_num_epochs)
+                t2 = time.perf_counter()
+            construction.append(t1-t0)
+            solve.append(t2-t1)
+        results[label] = {
+            'construction': min(construction),
+            'solve': min(solve),
+            'energy': float(linkage.energy())}
+    return(results)
+
+def benchmark_solvers(solvers=['sgd', 'lm']):
+    results = {}
+    builders = {
+        'three_bar': build_three_bar_linkage,
+        'linear_to_angular': build_linear_to_angular_linkage}
+    for name, build in builders.items():
+        for solver in solvers:
+            linkage = build(LinkageModel())
+            t0 = time.perf_counter()
+            result = linkage.update(solver=solver)
+            t1 = time.perf_counter()
+            results['{}/{}'.format(name, solver)] = {
+                'solve': t1-t0,
+                'energy': float(linkage.energy()),
+                'max_residual': linkage.residuals().abs().max().item(),
+                'num_iter': result.num_iter,
+                'reason': result.reason}
+    return(results)
+
+def benchmark_program(chain_lengths=[10, 50, 100, 200], repeats=5):
+    results = {}
+    for num_lines in chain_lengths:
+        linkage = build_chain_linkage(LinkageModel(), num_lines)
+        t0 = time.perf_counter()
+        for repeat in range(repeats):
+            linkage.energy().backward()
+        t1 = time.perf_counter()
+        program = linkage.compile()
+        values = program.get_values().requires_grad_(True)
+        t2 = time.perf_counter()
+        for repeat in range(repeats):
+            program.energy(values).backward()
+        t3 = time.perf_counter()
+        results[num_lines] = {'eager': (t1-t0)/repeats, 'compiled': (t3-t2)/repeats}
+    return(results)
+
+def benchmark_cache(repeats=5):
+    results = {}
+    builders = {
+        'three_bar': build_three_bar_linkage,
+        'linear_to_angular': build_linear_to_angular_linkage}
+    for name, build in builders.items():
+        for use_cache in [False, True]:
+            linkage = build(LinkageModel())
+            linkage.use_cache = use_cache
+            linkage.reset_cache_stats()
+            t0 = time.perf_counter()
+            for repeat in range(repeats):
+                linkage.energy().backward()
+            t1 = time.perf_counter()
+            results['{}/{}'.format(name, 'cache' if use_cache else 'no_cache')] = {
+                'energy': (t1-t0)/repeats,
+                'hit_rate': linkage.cache_hit_rate}
+    return(results)
+
+def benchmark_sweep(num_steps=100):
+    targets = np.linspace(0, 1, num_steps)
+    linkage = build_three_bar_linkage(LinkageModel())
+    linkage.update()
+    t0 = time.perf_counter()
+    sweep = linkage.sweep('line.a.theta', targets)
+    t1 = time.perf_counter()
+    theta = linkage.get_parameter('line.a.theta')
+    for target in targets:
+        theta.constrain(target=float(target))
+    t2 = time.perf_counter()
+    return({
+        'batched': t1-t0,
+        'sequential': t2-t1,
+        'max_residual': sweep.residuals.abs().max().item()})
+
+def benchmark_continuation(num_steps=360):
+    linkage = build_three_bar_linkage(LinkageModel())
+    linkage.update()
+    t0 = time.perf_counter()
+    path = linkage.continuation('line.a.theta', 2*np.pi)
+    t1 = time.perf_counter()
+    linkage = build_three_bar_linkage(LinkageModel())
+    linkage.update()
+    theta = linkage.get_parameter('line.a.theta')
+    theta.constrain(0.0)
+    num_iter = 0
+    t2 = time.perf_counter()
+    for target in np.linspace(0, 2*np.pi, num_steps+1)[1:]:
+        theta.target = float(target)
+        num_iter += linkage.update().num_iter
+    t3 = time.perf_counter()
+    return({
+        'continuation': t1-t0,
+        'continuation_iter': path.num_iter,
+        'continuation_steps': len(path.t),
+        'sequential': t3-t2,
+        'sequential_iter': num_iter})
+
+def benchmark_parameters(num_lines=200, repeats=10):
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 50*num_lines))
+    tracemalloc.start()
+    linkage = build_chain_linkage(LinkageModel(), num_lines)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    linkage.compiled = False
+    linkage.update(max_num_epochs=1, solver='sgd')
+    t0 = time.perf_counter()
+    linkage.update(max_num_epochs=repeats, solver='sgd')
+    t1 = time.perf_counter()
+    linkage.update(max_num_epochs=1, solver='lm')
+    t2 = time.perf_counter()
+    program = linkage.compile()
+    for repeat in range(repeats):
+        program.set_values(program.get_values())
+    t3 = time.perf_counter()
+    restore = None
+    if hasattr(linkage, 'save_params'):
+        values = linkage.save_params()
+        for repeat in range(repeats):
+            linkage.restore_params(values)
+        restore = (time.perf_counter()-t3)/repeats
+    return({
+        'time': {
+            'sgd_step': (t1-t0)/repeats,
+            'lm_step': t2-t1,
+            'values': (t3-t2)/repeats,
+            'restore': restore},
+        'stats': {
+            'num_lines': num_lines,
+            'num_free_params': len(linkage.get_param_dict()),
+            'memory': memory}})
+
+def benchmark_parameters_at(revision, num_lines=200, repeats=10):
+    root = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as path:
+        archive = subprocess.run(['git', 'archive', revision], cwd=root, capture_output=True, check=True)
+        subprocess.run(['tar', '-x', '-C', path], input=archive.stdout, check=True)
+        script = '\n'.join([
+            'import sys, os, time, json, tracemalloc, warnings',
+            'warnings.simplefilter("ignore")',
+            'from model import LinkageModel',
+            inspect.getsource(build_chain_linkage),
+            inspect.getsource(benchmark_parameters),
+            'print(json.dumps(benchmark_parameters({}, {})))'.format(num_lines, repeats)])
+        output = subprocess.run([sys.executable, '-c', script], cwd=path, capture_output=True, text=True,
+                                check=True).stdout
+    return(json.loads(output.strip().splitlines()[-1]))
+
+def benchmark_components(num_mechanisms=[1, 10, 50], repeats=3):
+    results = {}
+    for num in num_mechanisms:
+        results[num] = {}
+        for decompose in [False, True]:
+            linkage = LinkageModel()
+            linkage.decompose = decompose
+            for i in range(num):
+                build_three_bar_linkage(linkage)
+            linkage.update()
+            theta = linkage.get_parameter('line.a.theta')
+            t0 = time.perf_counter()
+            for repeat in range(repeats):
+                with linkage.solve_off():
+                    theta.tensor = [0.1*(repeat+1)]
+                result = linkage.update()
+            t1 = time.perf_counter()
+            results[num]['decomposed' if decompose else 'global'] = (t1-t0)/repeats
+            if decompose:
+                results[num]['skipped'] = result.num_skipped
+    return(results)
+
+def benchmark_incremental(num_mechanisms=[1, 17], num_steps=20):
+    results = {}
+    for num in num_mechanisms:
+        linkage = LinkageModel()
+        for i in range(num):
+            build_three_bar_linkage(linkage)
+        linkage.update()
+        times = []
+        for target in np.linspace(0.2, 0.6, num_steps):
+            t0 = time.perf_counter()
+            linkage.set_parameter('line.a.theta', [float(target)])
+            times.append(time.perf_counter()-t0)
+        results[num] = {'num_lines': len(linkage.lines), 'set_parameter': float(np.median(times))}
+    return(results)
+
+def benchmark_closed_form(num_steps=20):
+    results = {}
+    for solver in ['sgd', 'lm']:
+        for closed_form in [False, True]:
+            linkage = build_three_bar_linkage(LinkageModel())
+            linkage.solver = solver
+            linkage.closed_form = closed_form
+            linkage.update()
+            num_iter = 0
+            t0 = time.perf_counter()
+            for target in np.linspace(0.2, 0.6, num_steps):
+                linkage.set_parameter('line.a.theta', [float(target)])
+                num_iter += linkage.trace.num_iter
+            t1 = time.perf_counter()
+            program = linkage.compile()
+            results['{}/{}'.format(solver, 'closed_form' if closed_form else 'iterative')] = {
+                'set_parameter': (t1-t0)/num_steps,
+                'num_iter': num_iter/num_steps,
+                'energy': program.energy(program.get_values()).item()}
+    return(results)
+
+def benchmark_study(num_samples=1024, max_workers=None):
+    max_workers = os.cpu_count() if max_workers is None else max_workers
+    linkage = build_three_bar_linkage(LinkageModel())
+    linkage.update()
+    samples = np.linspace(0, 2*np.pi, num_samples)
+    results = {'max_workers': max_workers}
+    for label, workers in [('serial', 1), ('parallel', max_workers)]:
+        t0 = time.perf_counter()
+        study = run_study(linkage, ['line.a.theta'], samples, max_workers=workers)
+        results[label] = time.perf_counter()-t0
+    results['converged'] = float(study.converged.mean())
+    return(results)
+
+def benchmark_files(num_lines=500, repeats=3):
+    class CountingView(LinkageView):
+        def __init__(self):
+            self.num_events = 0
+        def structure_changed(self):
+            self.num_events += 1
+    class CountingLinkage(LinkageModel):
+        def __init__(self):
+            super(CountingLinkage, self).__init__()
+            self.view = self.attach_view(CountingView())
+    path = os.path.join(tempfile.mkdtemp(), 'linkage.npz')
+    results = {}
+    t0 = time.perf_counter()
+    for repeat in range(repeats):
+        linkage = build_chain_linkage(CountingLinkage(), num_lines)
+    t1 = time.perf_counter()
+    linkage.save(path)
+    t2 = time.perf_counter()
+    for repeat in range(repeats):
+        loaded = CountingLinkage.load(path)
+    t3 = time.perf_counter()
+    return({
+        'build': (t1-t0)/repeats,
+        'build_events': linkage.view.num_events,
+        'save': t2-t1,
+        'load': (t3-t2)/repeats,
+        'load_events': loaded.view.num_events,
+        'size': os.path.getsize(path)})
+
+def benchmark_sparse(num_arms=[50, 100, 230]):
+    ProgramProblem(build_ring_linkage(LinkageModel(), 10).compile(), sparse=True).linearize()
+    results = {}
+    for num in num_arms:
+        results[num] = {}
+        for sparse in [False, True]:
+            program = build_ring_linkage(LinkageModel(), num).compile()
+            t0 = time.perf_counter()
+            result = levenberg_marquardt(ProgramProblem(program, sparse=sparse))
+            t1 = time.perf_counter()
+            results[num]['sparse' if sparse else 'dense'] = t1-t0
+            results[num]['num_iter'] = result.num_iter
+        pattern = program.get_jacobian_pattern()
+        results[num].update(shape=pattern.shape, density=pattern.density, num_colors=len(pattern.seeds))
+    return(results)
+
+def benchmark_large_ring(num_arms=[1000, 5000, 10000]):
+    build_ring_linkage(LinkageModel(), 10).update()
+    results = {}
+    for num in num_arms:
+        linkage = build_ring_linkage(LinkageModel(), num)
+        program = linkage.compile()
+        t0 = time.perf_counter()
+        result = linkage.update()
+        t1 = time.perf_counter()
+        results[num] = {
+            'solve': t1-t0,
+            'num_iter': result.num_iter,
+            'reason': result.reason,
+            'num_constraints': program.num_residuals,
+            'num_params': len(program.free_index),
+            'max_residual': program.residuals(program.get_values()).abs().max().item()}
+    return(results)
+
+######################################### Suite ########################################
+
+MECHANISMS = {
+    'three_bar': (build_three_bar_linkage, 'line.a.theta'),
+    'linear_to_angular': (build_linear_to_angular_linkage, 'line.b.theta'),
+    'broadcasting': (build_broadcasting_linkage, 'line.a.theta')}
+
+SCALING_SIZES = [10, 20, 50, 100, 200, 500, 1000]
+
+def benchmark_allocation(num_elements=100000, num_lookups=100000):
+    linkage = LinkageModel()
+    t0 = time.perf_counter()
+    with linkage.solve_off():
+        point = linkage.add_anchorpoint([0, 0, 0])
+        for i in range(num_elements//2):
+            line = linkage.add_frompointline(point, 1.0, 0.0)
+            point = linkage.add_anchorpoint([i, 0, 0])
+    t1 = time.perf_counter()
+    full_name = 'line.{}.theta'.format(line.name)
+    for i in range(num_lookups):
+        linkage.get_parameter(full_name)
+    t2 = time.perf_counter()
+    for i in range(num_lookups):
+        linkage.get_parameter(i % len(linkage.parameters))
+    t3 = time.perf_counter()
+    return({
+        'num_geometries': len(linkage.geometries),
+        'num_params': len(linkage.parameters),
+        'last_names': (point.name, line.name),
+        'construction': t1-t0,
+        'name_lookup': (t2-t1)/num_lookups,
+        'id_lookup': (t3-t2)/num_lookups})
+
+def benchmark_fast_path(modes=['trace', 'compile'], num_epochs=200):
+    mechanisms = {
+        'three-bar': build_three_bar_linkage,
+        'linear-to-angular': build_linear_to_angular_linkage,
+        'broadcasting': build_broadcasting_linkage,
+        '50-line chain': lambda linkage: build_chain_linkage(linkage, 50)}
+    results = {}
+    for label, build in mechanisms.items():
+        program = build(LinkageModel()).compile()
+        values = program.get_values()
+        results[label] = {}
+        for mode in [None]+modes:
+            t0 = time.perf_counter()
+            program.energy_and_grad(values, mode)
+            t1 = time.perf_counter()
+            for epoch in range(num_epochs):
+                program.energy_and_grad(values, mode)
+            t2 = time.perf_counter()
+            results[label][mode or 'eager'] = {'build': t1-t0, 'epoch': (t2-t1)/num_epochs}
+    return(results)
+
+def benchmark_precision(precisions=['float32', 'float64', 'mixed'], num_epochs=5000):
+    mechanisms = {
+        'three-bar lm': (build_three_bar_linkage, 'lm'),
+        '50-line chain lm': (lambda linkage: build_chain_linkage(linkage, 50), 'lm'),
+        '100-arm ring lm': (lambda linkage: build_ring_linkage(linkage, 100), 'lm'),
+        'linear-to-angular sgd': (build_linear_to_angular_linkage, 'sgd')}
+    for precision in precisions:
+        linkage = LinkageModel()
+        linkage.precision = precision
+        ProgramProblem(build_ring_linkage(linkage, 10).compile(), sparse=True).linearize()
+    results = {}
+    for label, (build, solver) in mechanisms.items():
+        results[label] = {}
+        for precision in precisions:
+            linkage = LinkageModel()
+            linkage.precision = precision
+            linkage.solver = solver
+            if solver == 'sgd':
+                linkage.tolerance = 1.0e-14
+                linkage.closed_form = False
+            with linkage.solve_off():
+                build(linkage)
+            t0 = time.perf_counter()
+            result = linkage.update(max_num_epochs=num_epochs if solver == 'sgd' else None)
+            t1 = time.perf_counter()
+            program = linkage.compile()
+            with torch.no_grad():
+                residuals = program.residuals(program.get_values())
+            results[label][precision] = {
+                'time': t1-t0,
+                'num_iter': result.num_iter,
+                'reason': result.reason,
+                'max_residual': residuals.abs().max().item()}
+    return(results)
+
+def benchmark_interference(num_arms=[20, 50, 100], num_steps=90):
+    results = {}
+    for num in num_arms:
+        linkage = build_ring_linkage(LinkageModel(), num)
+        linkage.update()
+        sweep = linkage.sweep('line.a.theta', np.linspace(0, 0.5, num_steps))
+        t0 = time.perf_counter()
+        result = linkage.check_interference(sweep, clearance=0.1)
+        t1 = time.perf_counter()
+        segments = result.segments
+        exclude = linkage.compile().get_connected_lines()
+        i, j = torch.triu_indices(segments.shape[1], segments.shape[1], 1)
+        distance = segment_distance(segments[:, i, 0], segments[:, i, 1], segments[:, j, 0], segments[:, j, 1])
+        connected = torch.isin(i*segments.shape[1]+j, exclude[:, 0]*segments.shape[1]+exclude[:, 1])
+        t2 = time.perf_counter()
+        results[num] = {
+            'num_lines': segments.shape[1],
+            'num_pairs': len(i),
+            'num_candidates': result.num_candidates,
+            'num_tested': result.num_tested,
+            'num_hits': len(result.hits),
+            'brute_force_hits': int((distance[:, ~connected] < 0.1).sum()),
+            'broad_phase': t1-t0,
+            'brute_force': t2-t1}
+    return(results)
+
+def benchmark_trajectory(num_steps=360):
+    linkage = build_three_bar_linkage(LinkageModel())
+    linkage.update()
+    points = [linkage.lines.e.p2, linkage.lines.b.p2, linkage.lines.a.p2]
+    t0 = time.perf_counter()
+    trajectory = points[0].trajectory('line.a.theta', num_steps)
+    t1 = time.perf_counter()
+    for point in points:
+        point.trajectory('line.a.theta', num_steps)
+    t2 = time.perf_counter()
+    linkage = build_three_bar_linkage(LinkageModel())
+    linkage.update()
+    path = []
+    t3 = time.perf_counter()
+    for target in trajectory.driver:
+        linkage.set_parameter('line.a.theta', [float(target)])
+        path.append([point.r.detach().numpy().ravel() for point in
+                     [linkage.lines.e.p2, linkage.lines.b.p2, linkage.lines.a.p2]])
+    t4 = time.perf_counter()
+    return({
+        'trajectory': t1-t0,
+        'cached_overlay': t2-t1,
+        'scripted': t4-t3,
+        'converged': float(trajectory.converged.mean()),
+        'arc_length': float(trajectory.arc_length[-1])})
+
+def benchmark_kinematics(num_steps=90, h=1.0e-3):
+    linkage = build_four_bar_linkage(LinkageModel())
+    linkage.update()
+    linkage.get_parameter('line.a.theta').lock()
+    targets = np.linspace(0.3, 1.3, num_steps)
+    sweep = linkage.sweep('line.a.theta', targets)
+    linkage.kinematics('line.a.theta')
+    t0 = time.perf_counter()
+    kinematics = linkage.kinematics('line.a.theta', sweep)
+    t1 = time.perf_counter()
+    point = linkage.lines.b.p2
+    velocities = []
+    t2 = time.perf_counter()
+    for target in targets:
+        r = []
+        for t in [target, target+h]:
+            linkage.set_parameter('line.a.theta', [float(t)])
+            r.append(point.r.detach().numpy().ravel())
+        velocities.append((r[1]-r[0])/h)
+    t3 = time.perf_counter()
+    row = kinematics.point_names.index(point.name)
+    return({
+        'implicit': t1-t0,
+        'finite_difference': t3-t2,
+        'max_difference': float(np.abs(np.array(velocities)-kinematics.point_velocities[:, row].numpy()).max()),
+        'max_velocity': float(kinematics.point_velocities[:, row].norm(dim=-1).max())})
+
+def measure(fn, repeats=1):
+    times = []
+    for repeat in range(repeats):
+        t0 = time.perf_counter()
+        value = fn()
+        times.append(time.perf_counter()-t0)
+    return(min(times), value)
+
+def energy_backward(linkage):
+    E = linkage.energy()
+    E.backward()
+    return(E)
+
+def compiled_energy_backward(linkage):
+    program = linkage.compile()
+    E = program.energy(program.get_values().requires_grad_(True))
+    E.backward()
+    return(E)
+
+def benchmark_mechanism(build, driver, num_steps=360, num_param_steps=5, repeats=3):
+    construction, linkage = measure(lambda: build(LinkageModel()), repeats)
+    energy, _ = measure(lambda: energy_backward(linkage), repeats)
+    linkage.compile()
+    compiled_energy, _ = measure(lambda: compiled_energy_backward(linkage), repeats)
+    linkages = [build(LinkageModel()) for repeat in range(repeats)]
+    solve, result = min([measure(linkage.update) for linkage in linkages], key=lambda m: m[0])
+    linkage = linkages[0]
+    sweep, sweep_result = measure(lambda: linkage.sweep(driver, np.linspace(0, 2*np.pi, num_steps)))
+    with tempfile.TemporaryDirectory() as directory:
+        full_energy, landscape = measure(lambda: linkage.compute_full_energy(
+            os.path.join(directory, 'energy.npy'), num_param_steps))
+        grid_size = int(np.prod(landscape.shape))
+    return({
+        'time': {
+            'construction': construction,
+            'energy_backward': energy,
+            'compiled_energy_backward': compiled_energy,
+            'update': solve,
+            'sweep': sweep,
+            'full_energy': full_energy},
+        'stats': {
+            'num_params': len(linkage.get_param_dict()),
+            'num_iter': result.num_iter,
+            'reason': result.reason,
+            'energy': float(linkage.energy()),
+            'sweep_steps': num_steps,
+            'sweep_converged': sweep_result.converged.float().mean().item(),
+            'full_energy_points': grid_size}})
+
+def benchmark_chain(num_lines, repeats=3):
+    construction, linkage = measure(lambda: build_chain_linkage(LinkageModel(), num_lines), repeats)
+    try:
+        energy = measure(lambda: energy_backward(linkage), repeats)[0]
+    except RecursionError:
+        energy = None
+    linkage.compile()
+    compiled_energy, _ = measure(lambda: compiled_energy_backward(linkage), repeats)
+    solve, result = measure(linkage.update)
+    snapshot, _ = measure(linkage.snapshot, repeats)
+    return({
+        'time': {
+            'construction': construction,
+            'energy_backward': energy,
+            'compiled_energy_backward': compiled_energy,
+            'update': solve,
+            'snapshot': snapshot},
+        'stats': {
+            'num_params': len(linkage.get_param_dict()),
+            'num_iter': result.num_iter,
+            'reason': result.reason,
+            'max_residual': linkage.compile().residuals(linkage.compile().get_values()).abs().max().item()}})
+
+def benchmark_scaling(sizes=SCALING_SIZES, repeats=3):
+    results = {}
+    for num_lines in sizes:
+        results[str(num_lines)] = benchmark_chain(num_lines, repeats)
+    return(results)
+
+def get_metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return({
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'num_threads': torch.get_num_threads()})
+
+def run_suite(sizes=SCALING_SIZES, repeats=3):
+    build_three_bar_linkage(LinkageModel()).update()
+    mechanisms = {}
+    for name, (build, driver) in MECHANISMS.items():
+        mechanisms[name] = benchmark_mechanism(build, driver, repeats=repeats)
+    return({
+        'meta': get_metadata(),
+        'mechanisms': mechanisms,
+        'parameters': {'200': benchmark_parameters()},
+        'scaling': benchmark_scaling(sizes, repeats)})
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=1)
+
+def load_results(path):
+    with open(path) as f:
+        return(json.load(f))
+
+def compare_results(old, new, threshold=0.2):
+    rows = []
+    for section in ['mechanisms', 'parameters', 'scaling']:
+        for name, result in new[section].items():
+            old_times = old.get(section, {}).get(name, {}).get('time', {})
+            for key, value in result.get('time', {}).items():
+                if value is None or old_times.get(key) is None:
+                    continue
+                ratio = value/old_times[key]
+                rows.append(('{}/{}/{}'.format(section, name, key), old_times[key], value, ratio,
+                             ratio > 1+threshold))
+    return(rows)
+
+def plot_scaling(results, path):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    scaling = {int(n): r for n, r in results['scaling'].items() if 'time' in r}
+    sizes = sorted(scaling)
+    fig, ax = plt.subplots(figsize=(6,4.5))
+    for key in scaling[sizes[0]]['time']:
+        points = [(n, scaling[n]['time'][key]) for n in sizes if scaling[n]['time'][key] is not None]
+        ax.loglog(*zip(*points), marker='o', label=key)
+    ax.set_xlabel('lines')
+    ax.set_ylabel('time (s)')
+    ax.legend()
+    fig.savefig(path)
+
+def print_suite(results):
+    for name, result in results['mechanisms'].items():
+        print('{:>18}: '.format(name)+', '.join(
+            ['{} {:.4f} s'.format(key, value) for key, value in result['time'].items()]))
+    for num_lines, result in results.get('parameters', {}).items():
+        print_parameters(result, '{:>12} lines'.format(num_lines))
+    for num_lines, result in results['scaling'].items():
+        print('{:>12} lines: '.format(num_lines)+', '.join(
+            ['{} {}'.format(key, 'n/a' if value is None else '{:.4f} s'.format(value))
+             for key, value in result['time'].items()]))
+
+def print_micro_benchmarks():
+    for label, result in benchmark_views().items():
+        print('{:>10}: construction {:8.4f} s, solve {:8.4f} s, E = {:.4g}'.format(
+            label, result['construction'], result['solve'], result['energy']))
+    for label, result in benchmark_solvers().items():
+        print('{:>24}: solve {:8.4f} s, E = {:.4g}, max residual = {:.4g}, {} iterations ({})'.format(
+            label, result['solve'], result['energy'], result['max_residual'], result['num_iter'],
+            result['reason']))
+    for num_lines, result in benchmark_program().items():
+        print('{:>5} lines: energy+backward eager {:8.4f} s, compiled {:8.4f} s'.format(
+            num_lines, result['eager'], result['compiled']))
+    for label, result in benchmark_cache().items():
+        print('{:>26}: eager energy+backward {:8.4f} s, cache hit rate {:.2f}'.format(
+            label, result['energy'], result['hit_rate']))
+    result = benchmark_sweep()
+    print('100-step sweep: batched {:8.4f} s, sequential {:8.4f} s, max residual {:.3g}'.format(
+        result['batched'], result['sequential'], result['max_residual']))
+    result = benchmark_continuation()
+    print('crank rotation: continuation {:8.4f} s ({} steps, {} iterations), sequential {:8.4f} s ({} iterations)'.format(
+        result['continuation'], result['continuation_steps'], result['continuation_iter'],
+        result['sequential'], result['sequential_iter']))
+    for num, result in benchmark_components().items():
+        print('{:>3} three-bar mechanisms, one edited: global solve {:8.4f} s, decomposed {:8.4f} s ({} skipped)'.format(
+            num, result['global'], result['decomposed'], result['skipped']))
+    for num, result in benchmark_incremental().items():
+        print('{:>3} lines: slider set_parameter {:8.4f} s'.format(result['num_lines'], result['set_parameter']))
+    for label, result in benchmark_closed_form().items():
+        print('{:>26}: three-bar set_parameter {:8.4f} s, {:.1f} iterations, E = {:.3g}'.format(
+            label, result['set_parameter'], result['num_iter'], result['energy']))
+    result = benchmark_study()
+    print('1024-sample study: serial {:8.4f} s, {} workers {:8.4f} s, {:.0%} converged'.format(
+        result['serial'], result['max_workers'], result['parallel'], result['converged']))
+    result = benchmark_files()
+    print('500-line chain: build {:8.4f} s ({} view refreshes), save {:8.4f} s, load {:8.4f} s ({} refresh), {:.0f} kB'.format(
+        result['build'], result['build_events'], result['save'], result['load'], result['load_events'],
+        result['size']/1e3))
+    for num, result in benchmark_sparse().items():
+        print('{:>3}-arm ring ({}x{} Jacobian, density {:.3f}, {} colors): dense {:8.4f} s, sparse {:8.4f} s ({} iterations)'.format(
+            num, result['shape'][0], result['shape'][1], result['density'], result['num_colors'],
+            result['dense'], result['sparse'], result['num_iter']))
+    for num, result in benchmark_large_ring().items():
+        print('{:>5}-arm ring ({} constraints, {} params): solve {:8.4f} s, max residual {:.1e} ({} iterations, {})'.format(
+            num, result['num_constraints'], result['num_params'], result['solve'], result['max_residual'],
+            result['num_iter'], result['reason']))
+    for label, result in benchmark_fast_path().items():
+        print('{:>18}: energy+grad per epoch {}'.format(label, ', '.join(
+            '{} {:.3f} ms (first call {:.2f} s)'.format(mode, timing['epoch']*1e3, timing['build'])
+            for mode, timing in result.items())))
+    for label, result in benchmark_precision().items():
+        print('{:>22}: {}'.format(label, ', '.join(
+            '{} {:.4f} s to {:.1e} ({} iterations, {})'.format(
+                precision, timing['time'], timing['max_residual'], timing['num_iter'], timing['reason'])
+            for precision, timing in result.items())))
+    for num, result in benchmark_interference().items():
+        print('{:>3}-arm ring ({} lines, {} pairs, 90 steps): sweep-and-prune {:8.4f} s ({} candidates, {} tested, {} hits), brute force {:8.4f} s ({} hits)'.format(
+            num, result['num_lines'], result['num_pairs'], result['broad_phase'], result['num_candidates'],
+            result['num_tested'], result['num_hits'], result['brute_force'], result['brute_force_hits']))
+    result = benchmark_trajectory()
+    print('360-step coupler curve: trajectory {:8.4f} s, 3-point cached overlay {:8.4f} s, scripted set_parameter loop {:8.4f} s'.format(
+        result['trajectory'], result['cached_overlay'], result['scripted']))
+    result = benchmark_kinematics()
+    print('90-step four-bar velocities: implicit function theorem {:8.4f} s, finite-differenced update pairs {:8.4f} s (max difference {:.2g} of {:.2g})'.format(
+        result['implicit'], result['finite_difference'], result['max_difference'], result['max_velocity']))
+    result = benchmark_allocation()
+    print('{} geometries ({} parameters, last {}/{}): construction {:8.4f} s, lookup by name {:.2f} us, by id {:.2f} us'.format(
+        result['num_geometries'], result['num_params'], *result['last_names'], result['construction'],
+        result['name_lookup']*1e6, result['id_lookup']*1e6))
+    print_parameters(benchmark_parameters())
+
+def print_parameters(result, label='parameters'):
+    print('{} ({} lines, {} free parameters): construction {:.2f} MB, '.format(
+        label, result['stats']['num_lines'], result['stats']['num_free_params'], result['stats']['memory']/1e6)+', '.join(
+        ['{} {}'.format(key, 'n/a' if value is None else '{:.6f} s'.format(value))
+         for key, value in result['time'].items()]))
+
+if __name__ == '__main__':
+    warnings.simplefilter('ignore')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--json', help='write suite results to this file')
+    parser.add_argument('--compare', help='compare against results saved with --json')
+    parser.add_argument('--plot', help='save the chain scaling curves to this image')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SCALING_SIZES)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--micro', action='store_true', help='run the per-feature benchmarks')
+    parser.add_argument('--baseline', help='measure parameter storage at this git revision and at HEAD')
+    args = parser.parse_args()
+    if args.micro:
+        print_micro_benchmarks()
+        sys.exit()
+    if args.baseline:
+        print_parameters(benchmark_parameters_at(args.baseline), 'before ({})'.format(args.baseline))
+        print_parameters(benchmark_parameters(), 'after')
+        sys.exit()
+    results = run_suite(args.sizes, args.repeats)
+    print_suite(results)
+    if args.json:
+        save_results(results, args.json)
+    if args.plot:
+        plot_scaling(results, args.plot)
+    if args.compare:
+        for label, old, new, ratio, regression in compare_results(load_results(args.compare), results):
+            print('{:>50}: {:.4f} s -> {:.4f} s ({:.2f}x){}'.format(
+                label, old, new, ratio, '  REGRESSION' if regression else ''))
@@ -1,71 +1,124 @@
 import numpy as np
-from scipy import optimize
-import torch, itertools, string, time, copy, math
-from contextlib import contextmanager
-from munch import Munch
+import torch, time, copy, math, asyncio
 from ipywidgets import interact, interactive, fixed, interact_manual, widgets
 from ipywidgets import Button, Layout, jslink, IntText, IntSlider, GridspecLayout
 import IPython
 from IPython.display import display
 import matplotlib.pyplot as plt
 from settings import *
-from point import AtPoint, AnchorPoint, OnPointPoint, ToPointPoint, OnLinePoint
-from line import FromPointLine, FromPointsLine, OnPointLine, OnPointsLine
-import pandas as pd
-
-class Linkage():
-    def __init__(self):       
-        self.points = Munch(torch.nn.ModuleDict({}))
-        self.lines = Munch(torch.nn.ModuleDict({}))
-
-        self.names = {}
-        for _type in ['point', 'line']:
-            self.names[_type] = []
-            letters = string.ascii_letters[-26:]
-            if _type == 'line':
-                letters = letters.lower()
-            for n in range(3):
-                for t in itertools.product(letters, repeat=n):
-                    self.names[_type].append(''.join(t))
-            self.names[_type] = iter(self.names[_type][1:])
-        
-        self.tolerance = TOLERANCE
-        self.step_size = STEP_SIZE
-        self.fig_size = FIGSIZE
-        self.num_param_steps = NUM_PARAM_STEPS
-        
+from model import LinkageModel, LinkageView
+
+class Linkage(LinkageModel):
+    def __init__(self):
+        super(Linkage, self).__init__()
+        self.view = self.attach_view(NotebookView())
+
+    @property
+    def fig(self):
+        return(self.view.fig)
+
+    @property
+    def config_plot(self):
+        return(self.view.config_plot)
+
+    @property
+    def energy_plot(self):
+        return(self.view.energy_plot)
+
+    def show_controllers(self, create_grid=True, wait=True):
+        self.view.show_controllers(create_grid, wait)
+
+    def refresh_controller(self, button=None):
+        self.view.refresh_controller(button)
+
+    def update_info_box(self):
+        self.view.update_info_box()
+
+class NotebookView(LinkageView):
+    def __init__(self, fig_size=FIGSIZE, wait=True):
+        self.linkage = None
+        self.fig_size = fig_size
+        self.wait = wait
         self.grid = None
-        self.use_manual_params = False
-        self.use_explicit_coords = False
-        self.solve  = True
-        self.wait = True
-        self.one_shot_solve = False
-        
         self.fig = None
         self.config_plot = None
         self.energy_plot = None
+        self.info_box = None
+        self.controller_box = None
+        self.rendering = False
+        self.last_state = None
+
+    def attach(self, linkage):
+        super(NotebookView, self).attach(linkage)
         self.create_plots()
-        
-        self.full_energy = None
-        self.energy_updated = False
-        #self.show_controllers(wait=True)
-        
+
         self.info_box = widgets.Output(layout={'border': '1px solid black'})
         self.update_info_box()
         display(self.info_box)
-        
+
         self.controller_box = widgets.Output(layout={'border': '1px solid black'})
         with self.controller_box:
-            self.show_controllers(wait=True)
+            self.show_controllers(wait=self.wait)
         display(self.controller_box)
-        
+
+    ##################################### View Events ######################################
+
+    def structure_changed(self):
+        self.config_plot.update()
+        self.update_info_box()
+        self.refresh_controller()
+
+    def parameter_changed(self):
+        if self.linkage.use_async:
+            self.config_plot.request_frame()
+        else:
+            self.config_plot.update()
+
+    def parameter_set(self):
+        self.energy_plot.update_status_point()
+
+    def solve_started(self):
+        if not self.rendering:
+            self.rendering = True
+            self.schedule_frame()
+
+    def solve_progress(self):
+        if self.config_plot.request_frame():
+            time.sleep(0.01)
+
+    def solve_finished(self):
+        self.config_plot.update()
+        self.update_info_box()
+        time.sleep(0.01)
+
+    ####################################### Rendering ######################################
+
+    def schedule_frame(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.rendering = False
+            return
+        loop.call_later(1/self.config_plot.frame_rate, self.render_frame)
+
+    def render_frame(self):
+        worker = self.linkage.worker
+        state = self.linkage.poll()
+        if state is not None and not state.done and state is not self.last_state:
+            self.last_state = state
+            self.config_plot.request_frame(worker.get_positions(state))
+        if self.linkage.solving:
+            self.schedule_frame()
+        else:
+            self.rendering = False
+
     ################################# Plots and Controllers ################################
-    
+
     def create_plots(self):
         self.fig = plt.figure(figsize=(2*self.fig_size,self.fig_size))
         self.config_plot = LinkagePlot(self, show_origin=False)
         self.energy_plot = EnergyPlot(self)
-    
+
     def create_grid(self):
         self.grid = GridspecLayout(5, 10, height='150px', width='850px')
         self.grid[:-1,:5] = widgets.Output()
@@ -93,333 +146,15 @@ class Linkage():
             layout=Layout(height='auto', width='auto'))            
         refresh_button.on_click(self.refresh_controller)
         return(refresh_button)
-    
-    ######################################## Points ########################################
-    
-    def add_atpoint(self, at):
-        name = next(self.names['point'])
-        self.points[name] = AtPoint(self, name, at)
-        self.config_plot.update()
-        self.energy_updated = False
-        self.update_info_box()
-        self.refresh_controller()
-        return(self.points[name])
-    
-    def add_anchorpoint(self, at):
-        name = next(self.names['point'])
-        self.points[name] = AnchorPoint(self, name, at)
-        self.config_plot.update()
-        self.energy_updated = False
-        self.update_info_box()
-        self.refresh_controller()
-        return(self.points[name])
-    
-    def add_onpointpoint(self, parent):
-        name = next(self.names['point'])
-        self.points[name] = OnPointPoint(self, name, parent)
-        self.config_plot.update()
-        self.energy_updated = False
-        self.update_info_box()
-        self.refresh_controller()
-        return(self.points[name])
-    
-    def add_topointpoint(self, at, parent):
-        name = next(self.names['point'])
-        self.points[name] = ToPointPoint(self, name, at, parent)
-        self.config_plot.update()
-        self.energy_updated = False
-        self.update_info_box()
-        self.refresh_controller()
-        return(self.points[name])
-    
-    def add_onlinepoint(self, parent, alpha=None):
-        name = next(self.names['point'])
-        self.points[name] = OnLinePoint(self, name, parent, alpha)
-        self.config_plot.update()
-        self.energy_updated = False
-        self.update_info_box()
-        self.refresh_controller()
-        return(self.points[name])
-    
-    ######################################## Lines #########################################
-    
-    def add_frompointline(self, parent, L, theta, phi=None, ux=None, uz=None, locked=False):
-        name = next(self.names['line'])
-        self.lines[name] = FromPointLine(self, name, parent, L, theta, phi, ux, uz, locked)
-        self.config_plot.update()
-        self.energy_updated = False
-        self.update_info_box()
-        self.refresh_controller()
-        return(self.lines[name])
-    
-    def add_frompointsline(self, parent1, parent2):
-        name = next(self.names['line'])
-        self.lines[name] = FromPointsLine(self, name, parent1, parent2)
-        self.config_plot.update()
-        self.energy_updated = False
-        self.update_info_box()
-        self.refresh_controller()
-        return(self.lines[name])
-    
-    def add_onpointline(self, parent, L, theta, phi=None, ux=None, uz=None, beta=None):
-        name = next(self.names['line'])
-        self.lines[name] = OnPointLine(self, name, parent, L, theta, phi, ux, uz, beta)
-        self.config_plot.update()
-        self.energy_updated = False
-        self.update_info_box()
-        self.refresh_controller()
-        return(self.lines[name])
-        
-    def add_onpointsline(self, parent1, parent2, L, gamma=None):
-        name = next(self.names['line'])
-        self.lines[name] = OnPointsLine(self, name, parent1, parent2, L, gamma)
-        self.config_plot.update()
-        self.energy_updated = False
-        self.update_info_box()
-        self.refresh_controller()
-        return(self.lines[name]) 
-        
-    ########################################################################################
-        
+
     def update_info_box(self):
         self.info_box.clear_output()
         with self.info_box:
-            self.get_state()
-        
-    def get_state(self):
-        print('use_manual_params: {}'.format(self.use_manual_params))
-        print('use_explicit_coords: {}'.format(self.use_explicit_coords))
-        print('solve: {}'.format(self.solve))
-        print('energy_updated: {}'.format(self.energy_updated))
-        print('wait: {}'.format(self.wait))
-        print('one_shot_solve: {}\n'.format(self.one_shot_solve))
-        self.info()
-        
-    def info(self):
-        print('Points')
-        if not bool(list(self.points.values())):
-            print('\tNone')
-        for point in self.points.values():
-            point.info()
-        print('Lines')
-        if not bool(list(self.lines.values())):
-            print('\tNone')
-        for line in self.lines.values():
-            line.info()
-            
-    def get_df(self):
-        df = pd.DataFrame(columns=
-                          ['Full Name', 
-                           'Type', 
-                           'Geometry', 
-                           'Parameter Name', 
-                           'Parameter Value', 
-                           'Locked?', 
-                           'Constrained?',
-                           'Constraint Target',
-                           'Energy'])
-        for geom_type in ['point', 'line']:
-            if geom_type == 'point':
-                geoms = self.points
-            else:
-                geoms = self.lines
-            for geom in geoms.values():
-                constraint_target = None
-                if geom.type == 'line':
-                    try:
-                        constraint_target = geom.target_length
-                    except:
-                        pass
-                param_dict = {
-                    'Full Name': [geom.name],
-                    'Type': [geom.type],
-                    'Geometry': [geom.__repr__()],
-                    'Parameter Name': [None],
-                    'Parameter Value': [None],
-                    'Locked?': [None],
-                    'Constrained?': [geom.is_length_constrained() if geom.type == 'line' else None],
-                    'Constraint Target': [constraint_target],
-                    'Energy': geom.E()
-                }
-                df = pd.concat([df, pd.DataFrame(param_dict)])
-                for param in geom.params.values():
-                    full_param_name = '{}.{}'.format(geom.name, param.name)
-                    param_dict = {
-                        'Full Name': [full_param_name],
-                        'Type': [geom.type],
-                        'Geometry': [geom.__repr__()],
-                        'Parameter Name': [param.name],
-                        'Parameter Value': [param.tensor.__repr__()],
-                        'Locked?': [param.locked],
-                        'Constrained?': [param.is_constrained],
-                        'Constraint Target': [param.target],
-                        'Energy': geom.E()
-                    }
-                    df = pd.concat([df, pd.DataFrame(param_dict)])
-        df = df.set_index ('Full Name')
-        return(df)
-       
-    @property
-    def N(self):
-        N = 0
-        N += len(self.points)
-        N += 2*len(self.lines)
-        return(N)
-    
-    @property
-    def M(self):
-        return(len(self.lines))
-
-    @contextmanager
-    def manual_on(self):
-        use_manual_params_0 = copy.deepcopy(self.use_manual_params)
-        self.use_manual_params = True
-        yield
-        self.use_manual_params = use_manual_params_0
-    
-    @contextmanager
-    def manual_off(self):
-        use_manual_params_0 = copy.deepcopy(self.use_manual_params)
-        self.use_manual_params = False
-        yield
-        self.use_manual_params = use_manual_params_0
-        
-    @contextmanager
-    def one_shot_solve(self):
-        one_shot_solve_0 = copy.deepcopy(self.one_shot_solve)
-        self.one_shot_solve = True
-        yield
-        self.one_shot_solve = one_shot_solve_0
-    
-    @contextmanager
-    def solve_on(self):
-        solve_0 = copy.deepcopy(self.solve)
-        self.solve = True
-        yield
-        self.solve = solve_0
-    
-    @contextmanager
-    def solve_off(self):
-        solve_0 = copy.deepcopy(self.solve)
-        self.solve = False
-        yield
-        self.solve = solve_0
-     
-    @contextmanager
-    def explicit_on(self):
-        use_explicit_coords_0 = copy.deepcopy(self.use_explicit_coords)
-        self.use_explicit_coords = True
-        yield
-        self.use_explicit_coords = use_explicit_coords_0
-    
-    @contextmanager
-    def explicit_off(self):
-        use_explicit_coords_0 = copy.deepcopy(self.use_explicit_coords)
-        self.use_explicit_coords = False
-        yield
-        self.use_explicit_coords = use_explicit_coords_0
-
-    def get_parameter(self, full_param_name):
-        obj_type, obj_name, param_name = full_param_name.split('.')
-        if obj_type == 'point':
-            return(self.points[obj_name].params[param_name])
-        elif obj_type == 'line':
-            return(self.lines[obj_name].params[param_name])
-        else:
-            raise Exception('Invalid parameter name.')
-        
-    def set_parameter(self, full_param_name, value):
-        obj_type, obj_name, param_name = full_param_name.split('.')
-        if obj_type in ['Point', 'point']:
-            obj = self.points[obj_name]
-        elif obj_type in ['Line', 'line']:
-            obj = self.lines[obj_name]
-        else:
-            raise Exception('Object type must be point or line.')
-        obj.set_parameter(param_name, value)
-        self.energy_plot.update_status_point()
-        '''
-        if not self.use_manual_params:
-            if self.energy_plot.x_widget is not None:
-                self.energy_plot.update(
-                    x_name=self.energy_plot.x_widget.value,
-                    y_name=self.energy_plot.y_widget.value)
-        '''
-    
-    def get_param_dict(self, get_torch_params=False):
-        parameters = {}
-        for geom in list(self.points.values())+list(self.lines.values()):
-            for param in geom.params.values():
-                if param.locked:
-                    continue
-                if get_torch_params and bool(list(param.parameters())):
-                    parameters[param.full_name] = list(param.parameters())[0]
-                elif not get_torch_params:
-                    parameters[param.full_name] = param
-        return(parameters)
-        
-    def get_torch_param_dict(self):
-        return(self.get_param_dict(get_torch_params=True))
-        
-    def energy(self):
-        E = 0.0
-        for geom in list(self.points.values())+list(self.lines.values()):
-            E += geom.E()
-        return(E)
-        
-    def _energy(self):
-        with self.manual_on():
-            return(self.energy())
-        
-    def get_full_energy(self):
-        with self.solve_off():
-            if self.energy_updated:
-                return(self.full_energy)
-            with self.manual_on():
-                x0 = {}
-                for x in self.get_param_dict().values():
-                    x0[x.full_name] = x().tolist()
-                    v = np.linspace(x.min, x.max, self.num_param_steps)
-                    self.set_parameter(x.full_name, v.tolist())
-                E = self._energy()
-                for x in self.get_param_dict().values():
-                    self.set_parameter(x.full_name, x0[x.full_name])
-            self.full_energy = E
-            self.energy_updated = True
-        return(self.full_energy)
-        
-    def update(self, max_num_epochs=10000):
-        #E = self.get_full_energy()
-        #idx = (E==E.min()).to(torch.long).nonzero()
-        optimizer = torch.optim.SGD(self.get_torch_param_dict().values(), lr=LEARNING_RATE)
-        if self.one_shot_solve:
-            raise Exception()
-        else:
-            for epoch in range(max_num_epochs):
-                optimizer.zero_grad()
-                E = self.energy()
-                try:
-                    E.backward()
-                except:
-                    print('breaking')
-                    break
-                optimizer.step()
-                #print('E =', E.item())
-                if E <= self.tolerance:
-                    break
-                if epoch % N_UPDATE == 0:
-                    #print('updating')
-                    self.config_plot.update()
-                    time.sleep(0.01)
-            if False:
-                if (E > self.tolerance or E.isnan()):
-                    raise Exception('Could not solve all constraints.')
-            self.config_plot.update()
-            self.update_info_box()
-            time.sleep(0.01)
-        
+            print('wait: {}'.format(self.wait))
+            self.linkage.get_state()
+
     def update_param_bounds(self, *args):
-        param = self.get_parameter(self.param_name_widget.value)
+        param = self.linkage.get_parameter(self.param_name_widget.value)
         value = copy.deepcopy(param.tensor.item())
         self.value_widget.min = param.min
         self.value_widget.value = param.min
@@ -427,17 +162,17 @@ class Linkage():
         self.value_widget.value = value
         
     def show_controller(self, wait=True):
-        linkage = self
-        param_names = list(self.get_param_dict().keys())
+        linkage = self.linkage
+        param_names = list(linkage.get_param_dict().keys())
         if param_names:
             self.param_name_widget = widgets.Dropdown(
                 options=param_names, value=param_names[0])
-            param = self.get_parameter(param_names[0])
+            param = linkage.get_parameter(param_names[0])
             self.value_widget = widgets.FloatSlider(
-                min=param.min, max=param.max, step=self.step_size, value=param.tensor.item())
+                min=param.min, max=param.max, step=linkage.step_size, value=param.tensor.item())
         else:
             self.param_name_widget = widgets.Dropdown(options=[''], value='') 
-            self.value_widget = widgets.FloatSlider(min=0, max=1, step=self.step_size, value=0)
+            self.value_widget = widgets.FloatSlider(min=0, max=1, step=linkage.step_size, value=0)
         self.param_name_widget.observe(self.update_param_bounds, 'value')
         if wait:
             interact_manual(
@@ -451,17 +186,21 @@ class Linkage():
                 value=self.value_widget)
         
 class LinkagePlot():
-    def __init__(self, linkage, show_origin=True):
-        self.linkage = linkage
+    def __init__(self, view, show_origin=True):
+        self.view = view
+        self.linkage = view.linkage
         self.show_origin = show_origin
         self.origin = torch.tensor([0,0,0])
         self.fig_lim = FIGLIM
+        self.frame_rate = FRAME_RATE
+        self.last_frame = 0
         self.build_plot()
         self.points, self.anchors, self.lines = {}, {}, {}
+        self.trajectories = {}
         
     def build_plot(self):
         #self.fig = plt.figure(figsize=(self.fig_size,self.fig_size))
-        self.ax = self.linkage.fig.add_subplot(121, autoscale_on=False,
+        self.ax = self.view.fig.add_subplot(121, autoscale_on=False,
             xlim=(-self.fig_lim,self.fig_lim),
             ylim=(-self.fig_lim,self.fig_lim))
         self.ax.set_title('Configuration')
@@ -471,11 +210,28 @@ class LinkagePlot():
                 marker='+', s=50, c='black', alpha=1, label='origin')
         #time_template = ' t={:.0f}\n E={:.2f}\n T={:.5f}\n theta={:.0f}\n'
         #self.time_text = self.ax.text(0.05, 0.7, '', transform=self.ax.transAxes)
-        #self.linkage.fig.canvas.draw()
+        #self.view.fig.canvas.draw()
     
-    def update(self):
-        with self.linkage.manual_off():
-            for point_name in self.linkage.points.keys():
+    def request_frame(self, positions=None):
+        if time.perf_counter()-self.last_frame < 1/self.frame_rate:
+            return(False)
+        self.update(positions)
+        return(True)
+
+    def get_r(self, point, positions=None):
+        if positions is not None:
+            return(positions[point.name])
+        return(point.r.numpy())
+
+    def get_names(self, geometries, kind):
+        affected = self.linkage.affected
+        if affected is None:
+            return(list(geometries.keys()))
+        return([name for name in geometries.keys() if name in affected[kind]])
+
+    def update(self, positions=None):
+        with self.linkage.manual_off(), torch.no_grad():
+            for point_name in self.get_names(self.linkage.points, 'points'):
                 if self.linkage.points[point_name].__class__.__name__ == 'AnchorPoint':
                     color = 'blue'
                     size = 150
@@ -486,10 +242,9 @@ class LinkagePlot():
                     point = self.ax.scatter([], [], s=size, c=color,
                         zorder=0, label=point_name)
                     self.points[point_name] = point
-                point = self.linkage.points[point_name]
-                self.points[point_name].set_offsets(
-                    [[point.r[0].detach().numpy(),point.r[1].detach().numpy()]])
-            for line_name in self.linkage.lines.keys():
+                r = self.get_r(self.linkage.points[point_name], positions)
+                self.points[point_name].set_offsets([[r[0],r[1]]])
+            for line_name in self.get_names(self.linkage.lines, 'lines'):
                 ls, lw = ':', 1
                 if self.linkage.lines[line_name].is_length_constrained():
                     ls, lw = '-', 1
@@ -499,30 +254,52 @@ class LinkagePlot():
                         c='black', zorder=0, label=line_name)
                     self.lines[line_name] = line
                 line = self.linkage.lines[line_name]
-                self.lines[line_name].set_data(
-                    [line.p1.r[0].item(),line.p2.r[0].item()],
-                    [line.p1.r[1].item(),line.p2.r[1].item()])
+                r1, r2 = self.get_r(line.p1, positions), self.get_r(line.p2, positions)
+                self.lines[line_name].set_data([r1[0],r2[0]], [r1[1],r2[1]])
                 self.lines[line_name].set_linestyle(ls)
                 self.lines[line_name].set_linewidth(lw)
                 
-                for p in [line.p1, line.p2]:
+                for p, r in [(line.p1, r1), (line.p2, r2)]:
                     if p.name not in self.points.keys():
                         point = self.ax.scatter([], [],
                             s=10, c='red', zorder=0, label=p.name)
                         self.points[p.name] = point
-                    self.points[p.name].set_offsets(
-                        [[p.r[0].detach().numpy(),p.r[1].detach().numpy()]])
+                    self.points[p.name].set_offsets([[r[0],r[1]]])
         #self.time_text.set_text('')
-        self.linkage.fig.canvas.draw() ########################################## UNCOMMENTED
+        self.view.fig.canvas.draw() ########################################## UNCOMMENTED
+        self.last_frame = time.perf_counter()
+
+    def plot_trajectories(self, points, driver, num_steps=TRAJECTORY_NUM_STEPS, span=None, **kwargs):
+        style = dict(lw=1, alpha=0.7, zorder=0)
+        style.update(kwargs)
+        for point in points:
+            point = self.linkage.get_geometry(point) if type(point) is str else point
+            r = point.trajectory(driver, num_steps, span).positions
+            if point.name not in self.trajectories:
+                self.trajectories[point.name], = self.ax.plot([], [], label='{} path'.format(point.name), **style)
+            elif kwargs:
+                self.trajectories[point.name].set(**kwargs)
+            self.trajectories[point.name].set_data(r[:,0], r[:,1])
+        self.view.fig.canvas.draw()
+        return(self.trajectories)
+
+    def clear_trajectories(self):
+        for artist in self.trajectories.values():
+            artist.remove()
+        self.trajectories = {}
+        self.view.fig.canvas.draw()
 
 class EnergyPlot():
-    def __init__(self, linkage):
-        self.linkage = linkage
+    def __init__(self, view):
+        self.view = view
+        self.linkage = view.linkage
         #self.fig_size = FIGSIZE
         #self.fig_lim = FIGLIM
         #self.num_param_steps = NUM_PARAM_STEPS
+        self.resolution = view.linkage.energy_plot_resolution
         #self.num_contour_levels = NUM_CONTOUR_LEVELS
-        #self.cmap = CMAP
+        self.cmap = CMAP
+        self.im = None
         #self.x = None
         #self.y = None
         self.build_plot()
@@ -531,12 +308,12 @@ class EnergyPlot():
         
     def build_plot(self):
         #self.fig = plt.figure(figsize=(self.fig_size,self.fig_size))
-        self.ax = self.linkage.fig.add_subplot(122, autoscale_on=False,
+        self.ax = self.view.fig.add_subplot(122, autoscale_on=False,
             xlim=(0,1),
             ylim=(0,1))
         self.ax.set_title('Energy')
         self.status_point = self.ax.scatter([], [], s=25, c='white')
-        self.linkage.fig.canvas.draw()
+        self.view.fig.canvas.draw()
         
     def on_change_x(self, *args):
         current_y = copy.deepcopy(self.y_widget.value)
@@ -598,37 +375,22 @@ class EnergyPlot():
         self.ax.set_ylabel('{} ({})'.format(self.y.full_name, self.y.units))
     
     def draw_plot(self):
-        with self.linkage.solve_off():
-            E = self.linkage.get_full_energy()
-            x = np.linspace(self.x.min, self.x.max, self.num_param_steps)
-            y = np.linspace(self.y.min, self.y.max, self.num_param_steps)
-            def find_nearest(array, value):
-                idx = np.searchsorted(array, value, side='left')
-                if idx > 0 and (idx == len(array) or math.fabs(
-                    value - array[idx-1]) < math.fabs(value - array[idx])):
-                    return(idx-1)
-                else:
-                    return(idx)
-            z_index = {}
-            for d, param in enumerate(self.linkage.get_param_dict().values()):
-                if param.full_name not in [self.x.full_name, self.y.full_name]:
-                    z_index[d] = find_nearest(
-                        np.linspace(param.min, param.max, self.num_param_steps),
-                        param().item())
-                else:
-                    z_index[d] = None
-            E = E.detach().numpy()
-            for d in list(range(len(z_index)))[::-1]:
-                if z_index[d] is None:
-                    continue
-                E = np.take(E, [z_index[d]], axis=d)
-            E = E.squeeze().tolist()
-            X, Y = np.meshgrid(x, y)
-            #contourmap = self.ax.contourf(X, Y, E, levels=self.num_contour_levels, cmap=self.cmap)
-            im = self.ax.imshow(E, interpolation='nearest', cmap=self.cmap, origin='lower',
-                extent=[self.x.min, self.x.max, self.y.min, self.y.max], aspect='auto')
-            x = self.x.tensor.item()
-            y = self.y.tensor.item()
-            self.status_point.set_offsets([[x,y]])
-            #self.fig.colorbar(contourmap)
-            self.linkage.fig.canvas.draw()
\ No newline at end of file
+        landscape = self.linkage.energy_landscape
+        if landscape is not None and set([self.x.full_name, self.y.full_name]) <= set(landscape.names):
+            fixed = {name: param.tensor.item() for name, param in self.linkage.get_param_dict().items()}
+            _, _, E = landscape.get_slice(self.x.full_name, self.y.full_name, fixed)
+        else:
+            energy_slice = self.linkage.get_energy_slice(self.x.full_name, self.y.full_name,
+                self.resolution)
+            E = energy_slice.E.numpy()
+        if self.im is not None:
+            self.im.remove()
+        #contourmap = self.ax.contourf(X, Y, E, levels=self.num_contour_levels, cmap=self.cmap)
+        self.im = self.ax.imshow(E, interpolation='nearest', cmap=self.cmap, origin='lower',
+            extent=[self.x.min, self.x.max, self.y.min, self.y.max], aspect='auto')
+        self.im.set_zorder(0)
+        x = self.x.tensor.item()
+        y = self.y.tensor.item()
+        self.status_point.set_offsets([[x,y]])
+        #self.fig.colorbar(contourmap)
+        self.view.fig.canvas.draw()
\ No newline at end of file
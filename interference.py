@@ -0,0 +1,77 @@
+import torch
+from munch import Munch
+from settings import *
+
+######################################## Distance ######################################
+
+def segment_distance(p1, p2, q1, q2, eps=1.0e-12):
+    d1, d2, r = p2-p1, q2-q1, p1-q1
+    a, e = (d1*d1).sum(-1), (d2*d2).sum(-1)
+    b, c, f = (d1*d2).sum(-1), (d1*r).sum(-1), (d2*r).sum(-1)
+    a_, e_, denom = a.clamp(min=eps), e.clamp(min=eps), a*e-b*b
+    zero = torch.zeros_like(a)
+    s = torch.where(denom > eps, ((b*f-c*e)/denom.clamp(min=eps)).clamp(0, 1), zero)
+    t = (b*s+f)/e_
+    s = torch.where(t < 0, (-c/a_).clamp(0, 1), torch.where(t > 1, ((b-c)/a_).clamp(0, 1), s))
+    t = t.clamp(0, 1)
+    s, t = torch.where(e > eps, s, (-c/a_).clamp(0, 1)), torch.where(e > eps, t, zero)
+    s, t = torch.where(a > eps, s, zero), torch.where(a > eps, t, torch.where(e > eps, (f/e_).clamp(0, 1), zero))
+    closest = (p1+s.unsqueeze(-1)*d1)-(q1+t.unsqueeze(-1)*d2)
+    return(closest.pow(2).sum(-1).pow(0.5))
+
+######################################## Broad phase ###################################
+
+def get_boxes(segments, margin):
+    return(segments.min(-2).values-margin, segments.max(-2).values+margin)
+
+def sweep_and_prune(lo, hi):
+    order = lo[:, 0].argsort()
+    lo, hi = lo[order], hi[order]
+    end = torch.searchsorted(lo[:, 0].contiguous(), hi[:, 0].contiguous(), right=True)
+    start = torch.arange(len(lo))+1
+    counts = (end-start).clamp(min=0)
+    i = torch.repeat_interleave(torch.arange(len(lo)), counts)
+    offsets = torch.cumsum(counts, 0)-counts
+    j = i+1+torch.arange(len(i))-offsets[i]
+    overlap = ((lo[i, 1:] <= hi[j, 1:]) & (lo[j, 1:] <= hi[i, 1:])).all(-1)
+    i, j = order[i[overlap]], order[j[overlap]]
+    return(torch.stack([torch.minimum(i, j), torch.maximum(i, j)], dim=-1))
+
+def remove_pairs(pairs, exclude, num_segments):
+    if exclude is None or len(exclude) == 0 or len(pairs) == 0:
+        return(pairs)
+    exclude = torch.as_tensor(exclude, dtype=torch.long).view(-1, 2)
+    excluded = torch.minimum(exclude[:, 0], exclude[:, 1])*num_segments+torch.maximum(exclude[:, 0], exclude[:, 1])
+    keep = ~torch.isin(pairs[:, 0]*num_segments+pairs[:, 1], excluded)
+    return(pairs[keep])
+
+####################################### Interference ###################################
+
+def find_interference(segments, clearance=0.0, exclude=None):
+    segments = segments.detach()
+    if segments.dim() == 3:
+        segments = segments.unsqueeze(0)
+    num_steps, num_segments = segments.shape[:2]
+    threshold = max(float(clearance), XTOL)
+    lo, hi = get_boxes(segments, threshold/2)
+    pairs = sweep_and_prune(lo.min(0).values, hi.max(0).values)
+    pairs = remove_pairs(pairs, exclude, num_segments)
+    i, j = pairs[:, 0], pairs[:, 1]
+    overlap = ((lo[:, i] <= hi[:, j]) & (lo[:, j] <= hi[:, i])).all(-1)
+    steps, candidates = overlap.nonzero(as_tuple=True)
+    a, b = segments[steps, i[candidates]], segments[steps, j[candidates]]
+    distance = segment_distance(a[:, 0], a[:, 1], b[:, 0], b[:, 1])
+    hit = distance < threshold
+    steps, candidates, distance = steps[hit], candidates[hit], distance[hit]
+    offending, inverse, counts = candidates.unique(return_inverse=True, return_counts=True)
+    min_distance = torch.full((len(offending),), float('inf'), dtype=distance.dtype)
+    min_distance = min_distance.scatter_reduce(0, inverse, distance, reduce='amin')
+    pair_steps = torch.split(steps[inverse.argsort(stable=True)], counts.tolist())
+    return(Munch(
+        pairs=pairs[offending],
+        min_distance=min_distance,
+        steps=list(pair_steps),
+        hits=torch.stack([steps, i[candidates], j[candidates]], dim=-1),
+        distance=distance,
+        num_candidates=len(pairs),
+        num_tested=int(overlap.sum())))
@@ -0,0 +1,35 @@
+import torch
+from torch.func import jvp
+from munch import Munch
+from settings import *
+from solver import batched_jacobian
+
+def directional_derivatives(fn, values, v, a=None):
+    d1 = lambda u: jvp(fn, (u,), (v,))[1]
+    f, dv = jvp(fn, (values,), (v,))
+    ddv = jvp(d1, (values,), (v,))[1]
+    if a is not None:
+        ddv = ddv+jvp(fn, (values,), (a,))[1]
+    return(f, dv, ddv)
+
+def solve_kinematics(residual_fn, position_fn, values, free, d, speed=1.0, acceleration=0.0):
+    values = values.detach()
+    residuals = lambda x: residual_fn(values.index_copy(-1, free, x))
+    r, J = batched_jacobian(residuals, values[..., free])
+    J_inv = torch.linalg.pinv(J)
+    e = torch.zeros_like(values)
+    e[..., d] = 1.0
+    f, F_t = jvp(residual_fn, (values,), (e,))
+    v = e*speed
+    v = v.index_copy(-1, free, -(J_inv @ (F_t*speed).unsqueeze(-1)).squeeze(-1))
+    f, dv, H = directional_derivatives(residual_fn, values, v)
+    a = e*acceleration
+    a = a.index_copy(-1, free, -(J_inv @ (H+F_t*acceleration).unsqueeze(-1)).squeeze(-1))
+    r, point_velocities, point_accelerations = directional_derivatives(position_fn, values, v, a)
+    return(Munch(
+        param_velocities=v,
+        param_accelerations=a,
+        point_velocities=point_velocities,
+        point_accelerations=point_accelerations,
+        residuals=f,
+        rank=torch.linalg.matrix_rank(J)))
@@ -0,0 +1,117 @@
+import numpy as np
+import torch, json, os
+from settings import *
+
+def get_progress_path(path):
+    return(path+'.progress.json')
+
+def read_progress(path):
+    progress_path = get_progress_path(path)
+    if not os.path.exists(progress_path) or not os.path.exists(path):
+        return(None)
+    with open(progress_path) as f:
+        return(json.load(f))
+
+def write_progress(path, progress):
+    progress_path = get_progress_path(path)
+    with open(progress_path+'.tmp', 'w') as f:
+        json.dump(progress, f)
+    os.replace(progress_path+'.tmp', progress_path)
+
+def get_chunk_size(program, memory_budget):
+    num_values = 2*len(program.params)+6*len(program.point_rows)+2*program.num_residuals
+    bytes_per_point = program.get_values().element_size()*num_values
+    return(max(1, int(memory_budget//bytes_per_point)))
+
+def compute_energy_landscape(program, path, names, axes, memory_budget=ENERGY_MEMORY_BUDGET,
+                             callback=None):
+    num_param_steps = [len(axis) for axis in axes]
+    base = program.get_values()
+    dtype = program.linkage.numpy_dtype
+    header = {
+        'dtype': dtype.name,
+        'names': names,
+        'axes': [axis.tolist() for axis in axes],
+        'base': base.tolist()}
+    progress = read_progress(path)
+    if progress is None or progress['header'] != header:
+        E = np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+            shape=tuple(num_param_steps))
+        progress = {'header': header, 'num_done': 0, 'complete': False}
+        write_progress(path, progress)
+    else:
+        E = np.load(path, mmap_mode='r+')
+    flat = E.reshape(-1)
+    columns = [program.param_index[id(program.linkage.get_parameter(name))] for name in names]
+    axes = [torch.as_tensor(axis, dtype=base.dtype) for axis in axes]
+    chunk_size = get_chunk_size(program, memory_budget)
+    start = progress['num_done']
+    while start < flat.size:
+        stop = min(start+chunk_size, flat.size)
+        index = torch.arange(start, stop)
+        values = base.repeat(stop-start, 1)
+        for column, axis, steps in reversed(list(zip(columns, axes, num_param_steps))):
+            values[:, column] = axis[index % steps]
+            index = index // steps
+        with torch.no_grad():
+            flat[start:stop] = program.energy(values).numpy()
+        E.flush()
+        start = stop
+        progress['num_done'] = start
+        write_progress(path, progress)
+        if callback is not None:
+            callback(start, flat.size)
+    progress['complete'] = True
+    write_progress(path, progress)
+    del(E)
+    return(EnergyLandscape(path))
+
+class EnergyLandscape():
+    def __init__(self, path):
+        self.path = path
+        progress = read_progress(path)
+        if progress is None:
+            raise Exception('No energy landscape at {}.'.format(path))
+        self.names = progress['header']['names']
+        self.axes = [np.array(axis) for axis in progress['header']['axes']]
+        self.num_done = progress['num_done']
+        self.complete = progress['complete']
+        self.E = np.load(path, mmap_mode='r')
+
+    @property
+    def shape(self):
+        return(self.E.shape)
+
+    def get_axis(self, name):
+        return(self.axes[self.names.index(name)])
+
+    def nearest_index(self, name, value):
+        return(int(np.abs(self.get_axis(name)-value).argmin()))
+
+    def get_slice(self, x_name, y_name, fixed={}):
+        index = []
+        for name, axis in zip(self.names, self.axes):
+            if name in [x_name, y_name]:
+                index.append(slice(None))
+            elif name in fixed:
+                index.append(self.nearest_index(name, fixed[name]))
+            else:
+                raise Exception('No value given for {}.'.format(name))
+        E = np.asarray(self.E[tuple(index)])
+        if self.names.index(x_name) < self.names.index(y_name):
+            E = E.T
+        return(self.get_axis(x_name), self.get_axis(y_name), E)
+
+    def argmin(self, chunk_size=ENERGY_LANDSCAPE_CHUNK_SIZE):
+        flat = self.E.reshape(-1)
+        best, best_index = np.inf, None
+        for start in range(0, min(flat.size, self.num_done), chunk_size):
+            chunk = np.asarray(flat[start:min(start+chunk_size, self.num_done)])
+            i = int(np.nanargmin(chunk)) if not np.isnan(chunk).all() else None
+            if i is not None and chunk[i] < best:
+                best, best_index = float(chunk[i]), start+i
+        if best_index is None:
+            return(None)
+        index = np.unravel_index(best_index, self.E.shape)
+        values = {name: float(axis[i]) for name, axis, i in zip(self.names, self.axes, index)}
+        return(best, values)
@@ -14,6 +14,7 @@ class Line(BaseGeometry):
         #self.parent = None
         self.p1 = None
         self.p2 = None
+        self.L = None
         
     @property
     def type(self):
@@ -24,17 +25,19 @@ class Line(BaseGeometry):
         return(self.p2.r-self.p1.r)
     
     def get_length(self):
-        try:
+        if self.L is not None:
             return(self.L)
-        except:
-            return(self.r.pow(2).sum().pow(0.5))
+        return(self.r.pow(2).sum().pow(0.5))
     
     @property
     def u(self):
-        return(self.r/self.get_length())
+        return(self.linkage.memoize(self, 'u', lambda: self.r/self.get_length()))
     
     def is_constrained(self):
         raise Exception('Override this method.')
+
+    def residuals(self):
+        return(self.get_constraint_residuals())
     
     def add_onlinepoint(self, alpha=None):
         new_point = self.linkage.add_onlinepoint(self, alpha)
@@ -79,6 +82,7 @@ class FromPointsLine(Line):
         self.p1 = OnPointPoint(self.linkage, '{}.{}'.format(self.name, '1'), parent=parent1)
         self.p2 = OnPointPoint(self.linkage, '{}.{}'.format(self.name, '2'), parent=parent2)
         self.target_length = None
+        self.branch = None
         
     def __repr__(self):
         label = self.__class__.__name__[:-4]
@@ -88,11 +92,16 @@ class FromPointsLine(Line):
         print('\t', self)
         self.param_info()
     
-    def constrain_length(self, L):
+    def constrain_length(self, L, branch=None):
         if self.p1.root().__class__.__name__ == 'AnchorPoint':
             if self.p2.root().__class__.__name__ == 'AnchorPoint':
                 raise Exception('Cannot constrain the length of a line with anchored endpoints.')
+        if branch not in [None, 1, -1]:
+            raise Exception('Branch must be None, 1 or -1.')
+        if self.target_length is None or L is None or (self.target_length == 0) != (L == 0):
+            self.linkage.invalidate_structure()
         self.target_length = L
+        self.branch = branch
         if self.linkage.solve:
             self.linkage.update()
         self.linkage.energy_updated = False
@@ -111,6 +120,14 @@ class FromPointsLine(Line):
                 E = E.squeeze()
             return(E)
         return(0)
+
+    def residuals(self):
+        if self.is_length_constrained() and self.target_length is not None:
+            dr = self.p2.r-self.p1.r
+            if self.target_length == 0:
+                return(dr)
+            return((dr.pow(2).sum().pow(0.5)-self.target_length).view(-1))
+        return(torch.zeros(0))
     
     def is_length_constrained(self):
         if self.target_length is not None:
@@ -0,0 +1,1078 @@
+import numpy as np
+import torch, string, copy, json
+from contextlib import contextmanager
+from munch import Munch
+from settings import *
+from point import Point, AtPoint, AnchorPoint, OnPointPoint, ToPointPoint, OnLinePoint
+from line import FromPointLine, FromPointsLine, OnPointLine, OnPointsLine
+from base import BaseGeometry
+from solver import (
+    LeastSquaresProblem, ProgramProblem, levenberg_marquardt, batched_levenberg_marquardt,
+    predictor_corrector)
+from program import LinkageProgram
+from param import ParameterArena
+from worker import SolveWorker
+from telemetry import SolveTrace
+from landscape import compute_energy_landscape, EnergyLandscape
+from interference import find_interference
+from trajectory import interpolate_path, get_arc_length, get_curvature, resample_by_arc_length
+from kinematics import solve_kinematics
+
+class LinkageView():
+    def attach(self, linkage):
+        self.linkage = linkage
+
+    def structure_changed(self):
+        pass
+
+    def parameter_changed(self):
+        pass
+
+    def parameter_set(self):
+        pass
+
+    def solve_started(self):
+        pass
+
+    def solve_progress(self):
+        pass
+
+    def solve_finished(self):
+        pass
+
+PRECISION_DTYPES = {'float32': torch.float, 'float64': torch.double, 'mixed': torch.double}
+
+STOP_REASONS = ['tolerance', 'gradient_tolerance', 'step_tolerance', 'max_iterations',
+                'callback', 'cancelled', 'backward_error', 'nan']
+
+def get_worst_reason(a, b):
+    return(a if STOP_REASONS.index(a) >= STOP_REASONS.index(b) else b)
+
+NAME_LETTERS = {'point': string.ascii_uppercase, 'line': string.ascii_lowercase}
+
+def get_name(index, letters):
+    name = ''
+    index += 1
+    while index > 0:
+        index, i = divmod(index-1, len(letters))
+        name = letters[i]+name
+    return(name)
+
+GEOMETRY_CLASS_NAMES = [
+    'AtPoint', 'AnchorPoint', 'OnPointPoint', 'ToPointPoint', 'OnLinePoint',
+    'FromPointLine', 'FromPointsLine', 'OnPointLine', 'OnPointsLine']
+GEOMETRY_CLASSES = {geometry_class.__name__: geometry_class for geometry_class in [
+    AtPoint, AnchorPoint, OnPointPoint, ToPointPoint, OnLinePoint,
+    FromPointLine, FromPointsLine, OnPointLine, OnPointsLine]}
+ARG_GEOMETRY, ARG_BOOL, ARG_SCALAR, ARG_VECTOR = 1, 2, 3, 4
+
+class LinkageModel():
+    def __init__(self):
+        self.arena = ParameterArena(dtype=PRECISION_DTYPES[PRECISION])
+        self._precision = PRECISION
+        self.points = Munch({})
+        self.lines = Munch({})
+        self.geometries = []
+        self.parameters = []
+        self.parameter_names = {}
+        self.num_names = {'point': 0, 'line': 0}
+
+        self.tolerance = TOLERANCE
+        self.solver = SOLVER
+        self.use_continuation = CONTINUATION
+        self.step_size = STEP_SIZE
+        self.num_param_steps = NUM_PARAM_STEPS
+        self.energy_plot_resolution = ENERGY_PLOT_RESOLUTION
+
+        self.use_manual_params = False
+        self.use_explicit_coords = False
+        self.solve  = True
+        self.one_shot_solve = False
+
+        self.full_energy = None
+        self.energy_updated = False
+        self.energy_slice = None
+        self.energy_landscape = None
+        self.static_columns = None
+
+        self.compiled = COMPILED
+        self.decompose = DECOMPOSE
+        self.closed_form = CLOSED_FORM
+        self.fast_path = FAST_PATH
+        self.structure_version = 0
+        self.program = None
+
+        self.use_cache = CACHE
+        self.param_version = 0
+        self.pass_id = 0
+        self.pass_depth = 0
+        self.cache_stats = Munch(hits=0, misses=0)
+
+        self.use_async = ASYNC_SOLVE
+        self.worker = None
+
+        self.trace = None
+        self.solve_callbacks = []
+
+        self.trajectory_cache = {}
+
+        self.views = []
+        self.affected = None
+
+        self.history = []
+
+    ######################################## Views #########################################
+
+    def attach_view(self, view):
+        view.attach(self)
+        self.views.append(view)
+        return(view)
+
+    def detach_view(self, view):
+        self.views.remove(view)
+
+    def notify_views(self, event, affected=None):
+        self.affected = affected
+        try:
+            for view in self.views:
+                getattr(view, event)()
+        finally:
+            self.affected = None
+
+    def structure_changed(self):
+        self.energy_updated = False
+        self.invalidate_structure()
+        self.notify_views('structure_changed')
+
+    def invalidate_structure(self):
+        self.structure_version += 1
+
+    def compile(self):
+        if self.program is None or self.program.version != self.structure_version:
+            self.program = LinkageProgram(self)
+        else:
+            self.program.update_targets()
+        return(self.program)
+
+    def get_affected(self, params):
+        if not self.compiled:
+            return(None)
+        program = self.compile()
+        return(program.get_affected_geometries([program.param(param) for param in params]))
+
+    ######################################## Cache #########################################
+
+    def bump_param_version(self):
+        self.param_version += 1
+
+    @contextmanager
+    def forward_pass(self):
+        if self.pass_depth == 0:
+            self.pass_id += 1
+        self.pass_depth += 1
+        try:
+            yield
+        finally:
+            self.pass_depth -= 1
+
+    def memoize(self, geom, name, fn):
+        grad_enabled = torch.is_grad_enabled()
+        if not self.use_cache or (grad_enabled and self.pass_depth == 0):
+            return(fn())
+        key = (self.param_version, self.use_manual_params, self.use_explicit_coords,
+               self.pass_id if grad_enabled else None)
+        if name in geom.cache and geom.cache[name][0] == key:
+            self.cache_stats.hits += 1
+            return(geom.cache[name][1])
+        self.cache_stats.misses += 1
+        value = fn()
+        geom.cache[name] = (key, value)
+        return(value)
+
+    @property
+    def cache_hit_rate(self):
+        total = self.cache_stats.hits+self.cache_stats.misses
+        return(self.cache_stats.hits/total if total else 0.0)
+
+    def reset_cache_stats(self):
+        self.cache_stats = Munch(hits=0, misses=0)
+
+    ###################################### Precision #######################################
+
+    @property
+    def precision(self):
+        return(self._precision)
+
+    @precision.setter
+    def precision(self, precision):
+        if precision not in PRECISION_DTYPES:
+            raise Exception('Precision must be float32, float64 or mixed.')
+        self._precision = precision
+        self.arena.set_dtype(PRECISION_DTYPES[precision])
+        self.clear_frames()
+        self.bump_param_version()
+
+    def clear_frames(self):
+        for line in self.lines.values():
+            for point in [line.p1, line.p2]:
+                if getattr(point, 'frame', None) is not None:
+                    point.frame = None
+
+    @property
+    def dtype(self):
+        return(self.arena.dtype)
+
+    @property
+    def numpy_dtype(self):
+        return(torch.empty(0, dtype=self.dtype).numpy().dtype)
+
+    @property
+    def solve_dtype(self):
+        return(torch.float if self.precision in ['float32', 'mixed'] else torch.double)
+
+    def run_lm(self, problem, max_num_iter, trace):
+        callback = self.get_lm_callback(problem, trace)
+        if self.precision != 'mixed':
+            return(levenberg_marquardt(problem, max_num_iter, callback=callback, trace=trace))
+        values = problem.values
+        problem.values = values.to(self.solve_dtype)
+        result = levenberg_marquardt(problem, max_num_iter, xtol=MIXED_XTOL, callback=callback, trace=trace)
+        problem.values = values.index_copy(0, problem.free_index, problem.get_x().to(values.dtype))
+        if result.reason in ['nan', 'cancelled', 'callback']:
+            return(result)
+        refinement = levenberg_marquardt(problem, MIXED_REFINE_NUM_ITER, callback=callback, trace=trace)
+        refinement.num_refine_iter = refinement.num_iter
+        refinement.num_iter += result.num_iter
+        return(refinement)
+
+    ######################################## Points ########################################
+
+    def next_name(self, kind):
+        name = get_name(self.num_names[kind], NAME_LETTERS[kind])
+        self.num_names[kind] += 1
+        return(name)
+
+    def create_geometry(self, kind, geometry_class, args):
+        name = self.next_name(kind)
+        self.history.append((kind, geometry_class.__name__, self.describe_args(args)))
+        geometry = geometry_class(self, name, *args)
+        geometry.id = len(self.geometries)
+        self.geometries.append(geometry)
+        (self.points if kind == 'point' else self.lines)[name] = geometry
+        return(geometry)
+
+    def register_parameter(self, param):
+        param.id = len(self.parameters)
+        self.parameters.append(param)
+        self.parameter_names[param.full_name] = param
+        return(param.id)
+
+    def add_point(self, point_class, *args):
+        point = self.create_geometry('point', point_class, args)
+        self.structure_changed()
+        return(point)
+
+    def add_atpoint(self, at):
+        return(self.add_point(AtPoint, at))
+
+    def add_anchorpoint(self, at):
+        return(self.add_point(AnchorPoint, at))
+
+    def add_onpointpoint(self, parent):
+        return(self.add_point(OnPointPoint, parent))
+
+    def add_topointpoint(self, at, parent):
+        return(self.add_point(ToPointPoint, at, parent))
+
+    def add_onlinepoint(self, parent, alpha=None):
+        return(self.add_point(OnLinePoint, parent, alpha))
+
+    ######################################## Lines #########################################
+
+    def add_line(self, line_class, *args):
+        line = self.create_geometry('line', line_class, args)
+        self.structure_changed()
+        return(line)
+
+    def add_frompointline(self, parent, L, theta, phi=None, ux=None, uz=None, locked=False):
+        return(self.add_line(FromPointLine, parent, L, theta, phi, ux, uz, locked))
+
+    def add_frompointsline(self, parent1, parent2):
+        return(self.add_line(FromPointsLine, parent1, parent2))
+
+    def add_onpointline(self, parent, L, theta, phi=None, ux=None, uz=None, beta=None):
+        return(self.add_line(OnPointLine, parent, L, theta, phi, ux, uz, beta))
+
+    def add_onpointsline(self, parent1, parent2, L, gamma=None):
+        return(self.add_line(OnPointsLine, parent1, parent2, L, gamma))
+
+    ##################################### Description ######################################
+
+    def describe_args(self, args):
+        return([('geometry', arg.name) if isinstance(arg, BaseGeometry) else arg for arg in args])
+
+    def get_geometry(self, name):
+        if type(name) is int:
+            return(self.geometries[name])
+        elif name in self.points:
+            return(self.points[name])
+        elif name in self.lines:
+            return(self.lines[name])
+        line_name, end = name.split('.')
+        return(getattr(self.lines[line_name], 'p{}'.format(end)))
+
+    def describe(self):
+        params, lines = {}, {}
+        for geom in list(self.points.values())+list(self.lines.values()):
+            for param in geom.params.values():
+                params[param.full_name] = Munch(tensor=param.tensor.tolist(), locked=param.locked,
+                    is_constrained=param.is_constrained, target=param.target)
+            if geom.__class__.__name__ == 'FromPointsLine':
+                lines[geom.name] = Munch(target_length=geom.target_length, branch=geom.branch)
+        return(Munch(
+            history=list(self.history),
+            params=params,
+            lines=lines,
+            settings=self.describe_settings()))
+
+    def describe_settings(self):
+        return(Munch(tolerance=self.tolerance, solver=self.solver, compiled=self.compiled,
+                     decompose=self.decompose, closed_form=self.closed_form, fast_path=self.fast_path,
+                     precision=self.precision, use_cache=self.use_cache))
+
+    def replay(self, history):
+        for kind, class_name, args in history:
+            args = [self.get_geometry(arg[1]) if type(arg) is tuple and arg[0] == 'geometry'
+                    else arg for arg in args]
+            self.create_geometry(kind, GEOMETRY_CLASSES[class_name], args)
+
+    @classmethod
+    def from_description(cls, description):
+        linkage = cls()
+        linkage.replay(description.history)
+        for key, value in description.settings.items():
+            setattr(linkage, key, value)
+        for full_name, state in description.params.items():
+            param = linkage.get_parameter(full_name)
+            param.locked = state.locked
+            param.tensor = state.tensor
+            param.is_constrained = state.is_constrained
+            param.target = state.target
+        for name, state in description.lines.items():
+            linkage.lines[name].target_length = state.target_length
+            linkage.lines[name].branch = state.branch
+        linkage.structure_changed()
+        return(linkage)
+
+    ######################################### Files ########################################
+
+    def get_history_arrays(self):
+        max_num_args = max([len(args) for kind, class_name, args in self.history]+[0])
+        refs, ref_index = [], {}
+        kind = np.zeros(len(self.history), dtype=np.int8)
+        num_args = np.array([len(args) for kind, class_name, args in self.history], dtype=np.int8)
+        arg_type = np.zeros((len(self.history), max_num_args), dtype=np.int8)
+        arg_ref = np.full((len(self.history), max_num_args), -1, dtype=np.int32)
+        arg_value = np.zeros((len(self.history), max_num_args, 3), dtype=np.float64)
+        for i, (geometry_kind, class_name, args) in enumerate(self.history):
+            kind[i] = GEOMETRY_CLASS_NAMES.index(class_name)
+            for j, arg in enumerate(args):
+                if arg is None:
+                    continue
+                elif type(arg) is tuple:
+                    arg_type[i,j] = ARG_GEOMETRY
+                    arg_ref[i,j] = ref_index.setdefault(arg[1], len(refs))
+                    if arg_ref[i,j] == len(refs):
+                        refs.append(arg[1])
+                elif type(arg) is bool:
+                    arg_type[i,j] = ARG_BOOL
+                    arg_value[i,j,0] = arg
+                elif np.ndim(arg) == 0:
+                    arg_type[i,j] = ARG_SCALAR
+                    arg_value[i,j,0] = arg
+                elif len(arg) <= 3:
+                    arg_type[i,j] = ARG_VECTOR+len(arg)
+                    arg_value[i,j,:len(arg)] = [float(a) for a in arg]
+                else:
+                    raise Exception('Cannot save argument {}.'.format(arg))
+        return(dict(kind=kind, num_args=num_args, arg_type=arg_type, arg_ref=arg_ref, arg_value=arg_value,
+                    refs=np.array(refs, dtype=str)))
+
+    @staticmethod
+    def get_history(arrays):
+        history, refs = [], arrays['refs'].tolist()
+        for kind, num_args, types, arg_refs, values in zip(arrays['kind'], arrays['num_args'],
+                arrays['arg_type'], arrays['arg_ref'], arrays['arg_value']):
+            geometry_class = GEOMETRY_CLASSES[GEOMETRY_CLASS_NAMES[kind]]
+            args = []
+            for arg_type, arg_ref, value in zip(types[:num_args], arg_refs, values):
+                if arg_type == ARG_GEOMETRY:
+                    args.append(('geometry', refs[arg_ref]))
+                elif arg_type == ARG_BOOL:
+                    args.append(bool(value[0]))
+                elif arg_type == ARG_SCALAR:
+                    args.append(float(value[0]))
+                elif arg_type >= ARG_VECTOR:
+                    args.append(value[:arg_type-ARG_VECTOR].tolist())
+                else:
+                    args.append(None)
+            history.append(('point' if issubclass(geometry_class, Point) else 'line',
+                            geometry_class.__name__, args))
+        return(history)
+
+    def save(self, path):
+        params = [param for geom in list(self.points.values())+list(self.lines.values())
+                  for param in geom.params.values()]
+        lines = [line for line in self.lines.values() if line.__class__.__name__ == 'FromPointsLine']
+        np.savez(path,
+            arena_values=self.arena.get_values().numpy(),
+            arena_locked=self.arena.locked[:self.arena.size].numpy(),
+            param_constrained=np.array([param.is_constrained for param in params], dtype=bool),
+            param_target=np.array([np.nan if param.target is None else float(param.target)
+                                   for param in params], dtype=np.float64),
+            line_target=np.array([np.nan if line.target_length is None else float(line.target_length)
+                                  for line in lines], dtype=np.float64),
+            line_branch=np.array([0 if line.branch is None else line.branch for line in lines], dtype=np.int8),
+            settings=np.array(json.dumps(self.describe_settings())),
+            **self.get_history_arrays())
+
+    @classmethod
+    def load(cls, path):
+        arrays = np.load(path)
+        linkage = cls()
+        linkage.replay(cls.get_history(arrays))
+        for key, value in json.loads(str(arrays['settings'])).items():
+            setattr(linkage, key, value)
+        if linkage.arena.size != len(arrays['arena_values']):
+            raise Exception('Saved parameters do not match the saved geometry.')
+        locked = torch.from_numpy(arrays['arena_locked'])
+        linkage.arena.set(0, torch.from_numpy(arrays['arena_values']), locked)
+        params = [param for geom in list(linkage.points.values())+list(linkage.lines.values())
+                  for param in geom.params.values()]
+        for param, constrained, target in zip(params, arrays['param_constrained'], arrays['param_target']):
+            param.locked = bool(locked[param.index])
+            param.is_constrained = bool(constrained)
+            param.target = None if np.isnan(target) else float(target)
+        lines = [line for line in linkage.lines.values() if line.__class__.__name__ == 'FromPointsLine']
+        for line, target, branch in zip(lines, arrays['line_target'], arrays['line_branch']):
+            line.target_length = None if np.isnan(target) else float(target)
+            line.branch = None if branch == 0 else int(branch)
+        linkage.bump_param_version()
+        linkage.structure_changed()
+        return(linkage)
+
+    ########################################################################################
+
+    def get_state(self):
+        print('use_manual_params: {}'.format(self.use_manual_params))
+        print('use_explicit_coords: {}'.format(self.use_explicit_coords))
+        print('solve: {}'.format(self.solve))
+        print('energy_updated: {}'.format(self.energy_updated))
+        print('one_shot_solve: {}\n'.format(self.one_shot_solve))
+        self.info()
+
+    def info(self):
+        print('Points')
+        if not bool(list(self.points.values())):
+            print('\tNone')
+        for point in self.points.values():
+            point.info()
+        print('Lines')
+        if not bool(list(self.lines.values())):
+            print('\tNone')
+        for line in self.lines.values():
+            line.info()
+
+    def get_static_columns(self, program):
+        if self.static_columns is not None and self.static_columns.version == program.version:
+            return(self.static_columns)
+        geometries, params = program.geometries, program.params
+        self.static_columns = Munch(
+            version=program.version,
+            geometries=Munch(
+                name=np.array([geom.name for geom in geometries], dtype=object),
+                type=np.array([geom.type for geom in geometries], dtype=object),
+                kind=np.array([geom.__class__.__name__ for geom in geometries], dtype=object)),
+            params=Munch(
+                full_name=np.array([param.full_name for param in params], dtype=object),
+                name=np.array([param.name for param in params], dtype=object),
+                geometry=np.array([program.geometry_index[id(param.parent)] for param in params],
+                                  dtype=np.int64),
+                locked=np.array([param.locked for param in params], dtype=bool),
+                min=np.array([param.min for param in params], dtype=float),
+                max=np.array([param.max for param in params], dtype=float),
+                units=np.array([param.units for param in params], dtype=object)))
+        return(self.static_columns)
+
+    def snapshot(self):
+        program = self.compile()
+        static = self.get_static_columns(program)
+        with torch.no_grad():
+            values = program.get_values()
+            energy = program.geometry_energy(values)
+        geometries, params = program.geometries, program.params
+        length_target = np.array([np.nan if getattr(geom, 'target_length', None) is None
+                                  else float(geom.target_length) for geom in geometries], dtype=float)
+        length_constrained = np.array([geom.type == 'line' and geom.is_length_constrained()
+                                       for geom in geometries], dtype=bool)
+        constrained = np.array([param.is_constrained for param in params], dtype=bool)
+        target = np.full(len(params), np.nan)
+        for i in constrained.nonzero()[0]:
+            target[i] = float(params[i].target)
+        return(Munch(
+            structure_version=program.version,
+            param_version=self.param_version,
+            geometries=Munch(static.geometries,
+                length_constrained=length_constrained,
+                length_target=length_target,
+                energy=energy.numpy()),
+            params=Munch(static.params,
+                value=values.numpy(),
+                constrained=constrained,
+                target=target)))
+
+    def get_df(self, snapshot=None):
+        import pandas as pd
+        snapshot = self.snapshot() if snapshot is None else snapshot
+        geometries, params = snapshot.geometries, snapshot.params
+        num_geometries, num_params = len(geometries.name), len(params.full_name)
+        order = np.argsort(np.concatenate([
+            np.arange(num_geometries), params.geometry]), kind='stable')
+        is_line = geometries.type == 'line'
+        owner = params.geometry
+        def column(geometry_column, param_column):
+            return(np.concatenate([geometry_column, param_column]).astype(object)[order])
+        df = pd.DataFrame({
+            'Full Name': column(geometries.name, np.char.add(np.char.add(
+                geometries.name[owner].astype(str), '.'), params.name.astype(str))),
+            'Type': column(geometries.type, geometries.type[owner]),
+            'Geometry': column(geometries.kind, geometries.kind[owner]),
+            'Parameter Name': column(np.full(num_geometries, None), params.name),
+            'Parameter Value': column(np.full(num_geometries, None), params.value),
+            'Locked?': column(np.full(num_geometries, None), params.locked),
+            'Constrained?': column(np.where(is_line, geometries.length_constrained, None),
+                                   params.constrained),
+            'Constraint Target': column(np.where(np.isnan(geometries.length_target), None,
+                geometries.length_target), np.where(np.isnan(params.target), None, params.target)),
+            'Energy': column(geometries.energy, geometries.energy[owner])})
+        df = df.set_index('Full Name')
+        return(df)
+
+    @property
+    def N(self):
+        N = 0
+        N += len(self.points)
+        N += 2*len(self.lines)
+        return(N)
+
+    @property
+    def M(self):
+        return(len(self.lines))
+
+    @contextmanager
+    def manual_on(self):
+        use_manual_params_0 = copy.deepcopy(self.use_manual_params)
+        self.use_manual_params = True
+        yield
+        self.use_manual_params = use_manual_params_0
+
+    @contextmanager
+    def manual_off(self):
+        use_manual_params_0 = copy.deepcopy(self.use_manual_params)
+        self.use_manual_params = False
+        yield
+        self.use_manual_params = use_manual_params_0
+
+    @contextmanager
+    def one_shot_solve(self):
+        one_shot_solve_0 = copy.deepcopy(self.one_shot_solve)
+        self.one_shot_solve = True
+        yield
+        self.one_shot_solve = one_shot_solve_0
+
+    @contextmanager
+    def solve_on(self):
+        solve_0 = copy.deepcopy(self.solve)
+        self.solve = True
+        yield
+        self.solve = solve_0
+
+    @contextmanager
+    def solve_off(self):
+        solve_0 = copy.deepcopy(self.solve)
+        self.solve = False
+        yield
+        self.solve = solve_0
+
+    @contextmanager
+    def explicit_on(self):
+        use_explicit_coords_0 = copy.deepcopy(self.use_explicit_coords)
+        self.use_explicit_coords = True
+        yield
+        self.use_explicit_coords = use_explicit_coords_0
+
+    @contextmanager
+    def explicit_off(self):
+        use_explicit_coords_0 = copy.deepcopy(self.use_explicit_coords)
+        self.use_explicit_coords = False
+        yield
+        self.use_explicit_coords = use_explicit_coords_0
+
+    def get_parameter(self, full_param_name):
+        if type(full_param_name) is int:
+            return(self.parameters[full_param_name])
+        param = self.parameter_names.get(full_param_name)
+        if param is None:
+            param = self.parameter_names.get(full_param_name[:1].lower()+full_param_name[1:])
+        if param is None:
+            raise Exception('Invalid parameter name.')
+        return(param)
+
+    def set_parameter(self, full_param_name, value):
+        param = self.get_parameter(full_param_name)
+        param.parent.set_parameter(param.name, value)
+        self.notify_views('parameter_set')
+
+    def get_param_dict(self):
+        parameters = {}
+        for param in self.parameters:
+            if not param.locked:
+                parameters[param.full_name] = param
+        return(parameters)
+
+    def has_free_params(self):
+        return(bool((~self.arena.locked[:self.arena.size]).any()))
+
+    def save_params(self):
+        return(self.arena.get_values())
+
+    def restore_params(self, values):
+        self.arena.set_values(values)
+        self.bump_param_version()
+
+    def energy(self):
+        E = 0.0
+        with self.forward_pass():
+            for geom in list(self.points.values())+list(self.lines.values()):
+                E += geom.E()
+        return(E)
+
+    def _energy(self):
+        with self.manual_on():
+            return(self.energy())
+
+    def get_full_energy(self, path=None):
+        if path is not None:
+            return(self.compute_full_energy(path))
+        with self.solve_off():
+            if self.energy_updated:
+                return(self.full_energy)
+            with self.manual_on():
+                x0 = {}
+                for x in self.get_param_dict().values():
+                    x0[x.full_name] = x().tolist()
+                    v = np.linspace(x.min, x.max, self.num_param_steps)
+                    self.set_parameter(x.full_name, v.tolist())
+                E = self._energy()
+                for x in self.get_param_dict().values():
+                    self.set_parameter(x.full_name, x0[x.full_name])
+            self.full_energy = E
+            self.energy_updated = True
+        return(self.full_energy)
+
+    def compute_full_energy(self, path, num_param_steps=None, memory_budget=ENERGY_MEMORY_BUDGET,
+                            callback=None):
+        num_param_steps = self.num_param_steps if num_param_steps is None else num_param_steps
+        params = self.get_param_dict()
+        axes = [np.linspace(param.min, param.max, num_param_steps) for param in params.values()]
+        self.energy_landscape = compute_energy_landscape(self.compile(), path, list(params.keys()),
+            axes, memory_budget, callback)
+        return(self.energy_landscape)
+
+    def load_full_energy(self, path):
+        self.energy_landscape = EnergyLandscape(path)
+        return(self.energy_landscape)
+
+    def get_energy_slice(self, x_name, y_name, resolution=None):
+        resolution = self.energy_plot_resolution if resolution is None else resolution
+        program = self.compile()
+        key = (program.version, self.param_version, x_name, y_name, resolution,
+               tuple(program.length_targets.tolist()), tuple(program.length_branches.tolist()),
+               tuple(program.param_targets.tolist()))
+        if self.energy_slice is not None and self.energy_slice.key == key:
+            return(self.energy_slice)
+        x_param, y_param = self.get_parameter(x_name), self.get_parameter(y_name)
+        values = program.get_values().repeat(resolution, resolution, 1)
+        x = torch.linspace(x_param.min, x_param.max, resolution, dtype=values.dtype)
+        y = torch.linspace(y_param.min, y_param.max, resolution, dtype=values.dtype)
+        values[..., program.param(x_param)] = x.view(1,-1)
+        values[..., program.param(y_param)] = y.view(-1,1)
+        with torch.no_grad():
+            E = [program.energy(chunk) for chunk in
+                 values.view(-1, values.shape[-1]).split(ENERGY_SLICE_CHUNK_SIZE)]
+        E = torch.cat([torch.zeros(0, dtype=values.dtype)]+E).view(resolution, resolution)
+        self.energy_slice = Munch(key=key, x=x, y=y, E=E)
+        return(self.energy_slice)
+
+    def residuals(self):
+        residuals = [torch.zeros(0)]
+        with self.forward_pass():
+            for geom in list(self.points.values())+list(self.lines.values()):
+                residuals.append(geom.residuals())
+        return(torch.cat(residuals))
+
+    def update(self, max_num_epochs=None, solver=None, changed=None):
+        solver = self.solver if solver is None else solver
+        result = None
+        if self.one_shot_solve:
+            raise Exception()
+        elif self.use_async and self.compiled and solver == 'lm':
+            self.solve_async(LM_MAX_NUM_ITERATIONS if max_num_epochs is None else max_num_epochs)
+            return(result)
+        elif solver == 'sgd':
+            result = self.sgd_update(MAX_NUM_EPOCHS if max_num_epochs is None else max_num_epochs)
+        elif solver == 'lm':
+            result = self.lm_update(LM_MAX_NUM_ITERATIONS if max_num_epochs is None else max_num_epochs,
+                                    changed)
+        else:
+            raise Exception('Solver must be sgd or lm.')
+        self.notify_views('solve_finished', result.get('affected'))
+        return(result)
+
+    def sgd_update(self, max_num_epochs):
+        trace = SolveTrace('sgd', self.solve_callbacks)
+        if self.compiled:
+            with trace.timer('compile'):
+                program = self.compile()
+            values = program.get_values()
+            if self.closed_form:
+                values = program.solve_dyads(values)
+            solve_values = values.to(self.solve_dtype)
+            x = torch.nn.Parameter(solve_values[program.free_index])
+            fast_energy = program.get_fast_energy(self.fast_path)
+            energy = lambda: fast_energy(solve_values.index_copy(0, program.free_index, x))
+            params = [x]
+        else:
+            energy = self.energy
+            params = [self.arena.values]
+        optimizer = torch.optim.SGD(params, lr=LEARNING_RATE)
+        reason, error, E = 'max_iterations', None, None
+        refine_epoch = 0
+        for epoch in range(max_num_epochs):
+            optimizer.zero_grad()
+            with trace.timer('forward'):
+                E = torch.as_tensor(energy())
+            if torch.isnan(E):
+                reason = 'nan'
+                break
+            if E <= self.tolerance:
+                trace.record(E.item(), 0.0, 0.0)
+                reason = 'tolerance'
+                break
+            with trace.timer('backward'):
+                try:
+                    E.backward()
+                except RuntimeError as e:
+                    reason, error = 'backward_error', str(e)
+                    break
+            with trace.timer('step'):
+                grad_norm = params[0].grad.norm().item()
+                optimizer.step()
+                self.bump_param_version()
+            if trace.record(E.item(), grad_norm, LEARNING_RATE*grad_norm):
+                reason = 'callback'
+                break
+            if epoch-refine_epoch > STAGNATION_WINDOW and trace.is_stagnating():
+                if not self.compiled or x.dtype == values.dtype:
+                    reason = 'step_tolerance'
+                    break
+                solve_values = values.index_copy(0, program.free_index, x.detach().to(values.dtype))
+                x = torch.nn.Parameter(solve_values[program.free_index])
+                params = [x]
+                optimizer = torch.optim.SGD(params, lr=LEARNING_RATE)
+                refine_epoch = epoch
+            if epoch % N_UPDATE == 0:
+                with trace.timer('plot'):
+                    if self.compiled and self.views:
+                        program.set_values(values.index_copy(0, program.free_index, x.detach().to(values.dtype)))
+                    self.notify_views('solve_progress')
+        if self.compiled:
+            program.set_values(values.index_copy(0, program.free_index, x.detach().to(values.dtype)))
+        self.trace = trace.finish(reason, error)
+        return(Munch(num_iter=trace.num_iter, cost=trace.energy[-1] if trace.energy else None,
+                     converged=reason == 'tolerance', cancelled=False, reason=reason, trace=trace))
+
+    def lm_update(self, max_num_iter, changed=None):
+        trace = SolveTrace('lm', self.solve_callbacks)
+        if self.compiled and self.decompose:
+            return(self.lm_update_components(max_num_iter, trace, changed))
+        if self.compiled:
+            with trace.timer('compile'):
+                problem = ProgramProblem(self.compile())
+            self.solve_closed_form(problem, trace)
+            result = self.run_lm(problem, max_num_iter, trace)
+        else:
+            problem = LeastSquaresProblem(
+                [self.arena.values], self.residuals, self.bump_param_version, self.arena.free_index)
+            result = levenberg_marquardt(problem, max_num_iter, callback=self.get_lm_callback(problem, trace),
+                                         trace=trace)
+        if self.compiled:
+            problem.program.set_values(problem.values)
+        self.trace = trace
+        return(result)
+
+    def lm_update_components(self, max_num_iter, trace, changed=None):
+        with trace.timer('compile'):
+            program = self.compile()
+            components = program.get_components()
+        result = Munch(num_iter=0, cost=0.0, converged=True, cancelled=False, reason='tolerance',
+                       trace=trace, num_components=len(components), num_skipped=0, affected=None)
+        if changed is None:
+            with trace.timer('forward'), torch.no_grad():
+                r = program.residuals(program.get_values())
+            result.cost = r.double().pow(2).sum().item()
+        else:
+            changed = [program.param(param) for param in changed]
+            components = program.get_affected_components(changed)
+            result.num_skipped = result.num_components-len(components)
+        for component in components:
+            if changed is None:
+                r_component = r[component.rows]
+                if r_component.abs().max().item() <= XTOL:
+                    result.num_skipped += 1
+                    continue
+            with trace.timer('compile'):
+                problem = ProgramProblem(program.get_component_program(component))
+            self.solve_closed_form(problem, trace)
+            component_result = self.run_lm(problem, max_num_iter, trace)
+            problem.program.set_values(problem.values)
+            result.num_iter += component_result.num_iter
+            result.cost += component_result.cost
+            if changed is None:
+                result.cost -= r_component.double().pow(2).sum().item()
+            else:
+                changed += component.free_index.tolist()
+            result.reason = get_worst_reason(result.reason, component_result.reason)
+            if component_result.reason in ['cancelled', 'callback']:
+                result.cancelled = component_result.cancelled
+                break
+        with trace.timer('forward'), torch.no_grad():
+            r = program.residuals(program.get_values())
+        if changed is not None:
+            r = r[torch.cat([component.rows for component in components])] if components else r[:0]
+            result.affected = program.get_affected_geometries(changed)
+        result.converged = len(r) == 0 or r.abs().max().item() <= XTOL
+        self.trace = trace.finish(result.reason)
+        return(result)
+
+    def solve_closed_form(self, problem, trace):
+        if self.closed_form:
+            with trace.timer('step'):
+                problem.values = problem.program.solve_dyads(problem.values)
+
+    def get_lm_callback(self, problem, trace):
+        def callback(i, cost):
+            if i % N_UPDATE == 0:
+                with trace.timer('plot'):
+                    if self.compiled and self.views:
+                        problem.program.set_values(problem.values)
+                    self.notify_views('solve_progress')
+        return(callback)
+
+    ######################################## Telemetry #####################################
+
+    def add_solve_callback(self, callback):
+        self.solve_callbacks.append(callback)
+        return(callback)
+
+    def remove_solve_callback(self, callback):
+        self.solve_callbacks.remove(callback)
+
+    ######################################## Async #########################################
+
+    @property
+    def solving(self):
+        return(self.worker is not None and not self.worker.applied)
+
+    def solve_async(self, max_num_iter=LM_MAX_NUM_ITERATIONS):
+        program = self.compile()
+        values = program.get_values()
+        if self.worker is not None and not self.worker.applied:
+            self.worker.cancel()
+            state = self.worker.slot.get()
+            if state is not None and self.worker.version == self.structure_version:
+                changed = values != self.worker.start_values
+                values = torch.where(changed, values, state.param_values)
+            self.worker.applied = True
+        if self.closed_form:
+            values = program.solve_dyads(values)
+        self.trace = SolveTrace('lm', self.solve_callbacks)
+        self.worker = SolveWorker(program, values, max_num_iter, self.trace).start()
+        self.notify_views('solve_started')
+        return(self.worker)
+
+    def poll(self):
+        if self.worker is None:
+            return(None)
+        state = self.worker.slot.get()
+        if state is not None and state.done and not self.worker.applied:
+            self.worker.applied = True
+            if self.worker.version == self.structure_version:
+                self.compile().set_values(state.param_values)
+                self.notify_views('solve_finished')
+        return(state)
+
+    def wait(self, timeout=None):
+        if self.worker is not None:
+            self.worker.join(timeout)
+        return(self.poll())
+
+    def sweep(self, driver, targets, max_num_iter=LM_MAX_NUM_ITERATIONS, values=None):
+        driver = self.get_parameter(driver) if type(driver) is str else driver
+        program = self.compile()
+        d = program.param(driver)
+        targets = torch.as_tensor(targets, dtype=self.dtype).view(-1,1)
+        if values is None:
+            values = program.get_values().expand(len(targets), -1)
+        values = values.clone()
+        values[:, d] = targets[:, 0]
+        free = program.free_index[program.free_index != d]
+        keep = program.get_residual_rows(exclude_params=[d])
+        def residual_fn(x):
+            return(program.residuals(values.index_copy(1, free, x))[..., keep])
+        result = batched_levenberg_marquardt(residual_fn, values[:, free], max_num_iter)
+        values = values.index_copy(1, free, result.x)
+        names = list(program.point_rows.keys())
+        with torch.no_grad():
+            positions = program.positions(values)[:, [program.point_rows[name] for name in names], :]
+        return(Munch(
+            names=names,
+            positions=positions,
+            param_values=values,
+            residuals=result.residuals,
+            converged=result.converged,
+            num_iter=result.num_iter))
+
+    def continuation(self, driver, target, write_back=True, **kwargs):
+        driver = self.get_parameter(driver) if type(driver) is str else driver
+        program = self.compile()
+        d = program.param(driver)
+        values = program.get_values()
+        free = program.free_index[program.free_index != d]
+        keep = program.get_residual_rows(exclude_params=[d])
+        def get_values(x, t):
+            return(values.index_copy(0, free, x).index_copy(0, torch.tensor([d]), t.view(1)))
+        def residual_fn(x, t):
+            return(program.residuals(get_values(x, t))[keep])
+        path = predictor_corrector(residual_fn, values[free], values[d].item(), float(target), **kwargs)
+        with torch.no_grad():
+            path.param_values = torch.stack([
+                get_values(x, torch.tensor(t, dtype=values.dtype)) for x, t in zip(path.x, path.t)])
+            names = list(program.point_rows.keys())
+            path.names = names
+            path.positions = program.positions(path.param_values)[:, [program.point_rows[n] for n in names], :]
+        path.t = torch.tensor(path.t, dtype=values.dtype)
+        del(path.x)
+        if write_back:
+            program.set_values(path.param_values[-1], index=torch.cat([free, torch.tensor([d])]))
+            self.notify_views('parameter_changed')
+        return(path)
+
+    ##################################### Interference #####################################
+
+    def check_interference(self, param_values=None, clearance=0.0, ignore_connected=True):
+        program = self.compile()
+        if param_values is None:
+            param_values = program.get_values()
+        elif not torch.is_tensor(param_values):
+            param_values = param_values.param_values
+        segments = program.get_segments(param_values)
+        exclude = program.get_connected_lines() if ignore_connected else None
+        result = find_interference(segments, clearance, exclude)
+        names = [line.name for line in program.get_lines()]
+        result.names = [(names[i], names[j]) for i, j in result.pairs.tolist()]
+        result.segments = segments
+        return(result)
+
+    ##################################### Trajectories #####################################
+
+    def get_trajectory_key(self, driver, num_steps, span):
+        program = self.compile()
+        return((driver.full_name, num_steps, span, self.structure_version, self.param_version,
+                tuple(program.length_targets.tolist()), tuple(program.length_branches.tolist()),
+                tuple(program.param_targets.tolist())))
+
+    def get_trajectories(self, driver, num_steps=TRAJECTORY_NUM_STEPS, span=None):
+        driver = self.get_parameter(driver) if type(driver) in [str, int] else driver
+        span = float(driver.max-driver.min if span is None else span)
+        key = self.get_trajectory_key(driver, num_steps, span)
+        if key in self.trajectory_cache:
+            return(self.trajectory_cache[key])
+        program = self.compile()
+        d = program.param(driver)
+        start = program.get_values()[d].item()
+        path = self.continuation(driver, start+span, write_back=False)
+        targets = torch.linspace(start, start+span, num_steps, dtype=path.param_values.dtype)
+        values = interpolate_path(path.param_values[:, d], path.param_values, targets)
+        sweep = self.sweep(driver, targets, values=values)
+        with torch.no_grad():
+            positions = program.positions(sweep.param_values)
+        trajectories = Munch(
+            driver=targets.numpy(),
+            param_values=sweep.param_values,
+            positions=positions.numpy(),
+            converged=sweep.converged.numpy(),
+            program=program)
+        self.trajectory_cache = {k: v for k, v in self.trajectory_cache.items() if k[3:] == key[3:]}
+        self.trajectory_cache[key] = trajectories
+        return(trajectories)
+
+    def get_trajectory(self, point, driver, num_steps=TRAJECTORY_NUM_STEPS, span=None, spacing='driver'):
+        driver = self.get_parameter(driver) if type(driver) in [str, int] else driver
+        trajectories = self.get_trajectories(driver, num_steps, span)
+        r = trajectories.positions[:, trajectories.program.row(point)]
+        t, param_values, converged = trajectories.driver, trajectories.param_values, trajectories.converged
+        if spacing == 'arc_length':
+            r, t = resample_by_arc_length(r, t, num_steps)
+            targets = torch.as_tensor(t, dtype=param_values.dtype)
+            d = trajectories.program.param(driver)
+            values = interpolate_path(param_values[:, d], param_values, targets)
+            sweep = self.sweep(driver, targets, values=values)
+            param_values, converged = sweep.param_values, sweep.converged.numpy()
+            r = sweep.positions[:, sweep.names.index(point.name)].numpy()
+        elif spacing != 'driver':
+            raise Exception('Spacing must be driver or arc_length.')
+        return(Munch(
+            driver=t,
+            param_values=param_values,
+            positions=r,
+            arc_length=get_arc_length(r),
+            curvature=get_curvature(r, t),
+            converged=converged))
+
+    ###################################### Kinematics ######################################
+
+    def kinematics(self, driver, param_values=None, speed=1.0, acceleration=0.0):
+        driver = self.get_parameter(driver) if type(driver) in [str, int] else driver
+        program = self.compile()
+        d = program.param(driver)
+        if param_values is None:
+            param_values = program.get_values()
+        elif not torch.is_tensor(param_values):
+            param_values = torch.as_tensor(param_values.param_values)
+        values = param_values.view(-1, len(program.params))
+        free = program.free_index[program.free_index != d]
+        keep = program.get_residual_rows(exclude_params=[d])
+        names = list(program.point_rows.keys())
+        rows = torch.tensor([program.point_rows[name] for name in names], dtype=torch.long)
+        result = solve_kinematics(
+            lambda values: program.residuals(values)[..., keep],
+            lambda values: program.positions(values)[..., rows, :],
+            values, free, d, speed, acceleration)
+        result.param_names = program.param_names
+        result.point_names = names
+        if param_values.dim() == 1:
+            for key in ['param_velocities', 'param_accelerations', 'point_velocities', 'point_accelerations',
+                        'residuals', 'rank']:
+                result[key] = result[key][0]
+        return(result)
@@ -1,19 +1,119 @@
-from base import BaseParameter
-
-class Parameter(BaseParameter):
-    def __init__(self, tensor, parent, name, range, units, locked=False):
-        super(Parameter, self).__init__(tensor, parent, name, range, units, locked)
-        self.manual = ManualParameter(tensor, parent, name, range, units, locked)
-        self.backup = ManualParameter([], parent, name, range, units, locked)
-       
-    def reset(self):
-        self.backup.tensor = self.manual.tensor.tolist()
-        self.manual.tensor = self.tensor.tolist()
-        
-    def restore(self):
-        self.manual.tensor = self.backup.tensor.tolist()
-        self.backup.tensor = []
-        
-class ManualParameter(BaseParameter):
-    def __init__(self, tensor, parent, name, range, units, locked=False):
-        super(ManualParameter, self).__init__(tensor, parent, name, range, units, locked)
\ No newline at end of file
+import torch
+from base import BaseParameter
+from settings import *
+
+class ParameterArena():
+    def __init__(self, capacity=ARENA_CAPACITY, dtype=torch.float):
+        self.size = 0
+        self.values = torch.nn.Parameter(torch.zeros(capacity, dtype=dtype))
+        self.locked = torch.ones(capacity, dtype=torch.bool)
+
+    @property
+    def capacity(self):
+        return(len(self.values))
+
+    @property
+    def dtype(self):
+        return(self.values.dtype)
+
+    def set_dtype(self, dtype):
+        if dtype != self.dtype:
+            self.values = torch.nn.Parameter(self.values.detach().to(dtype))
+
+    @property
+    def free_index(self):
+        return((~self.locked[:self.size]).nonzero().view(-1))
+
+    def allocate(self, values, locked):
+        if self.size+len(values) > self.capacity:
+            self.grow(max(2*self.capacity, self.size+len(values)))
+        index = self.size
+        self.size += len(values)
+        self.set(index, values, locked)
+        return(index)
+
+    def grow(self, capacity):
+        values = torch.zeros(capacity, dtype=self.dtype)
+        values[:self.size] = self.values.detach()[:self.size]
+        locked = torch.ones(capacity, dtype=torch.bool)
+        locked[:self.size] = self.locked[:self.size]
+        self.values = torch.nn.Parameter(values)
+        self.locked = locked
+
+    def get(self, index, size, locked):
+        tensor = self.values[index:index+size]
+        if locked:
+            return(tensor.detach())
+        return(tensor)
+
+    def set(self, index, values, locked):
+        with torch.no_grad():
+            self.values[index:index+len(values)] = values
+        self.locked[index:index+len(values)] = locked
+
+    def get_values(self, index=None):
+        values = self.values.detach()[:self.size]
+        if index is None:
+            return(values.clone())
+        return(values[index])
+
+    def set_values(self, values, index=None):
+        with torch.no_grad():
+            if index is None:
+                self.values[:len(values)] = values
+            else:
+                self.values.index_copy_(0, index, values.to(self.values.dtype))
+
+class Parameter(BaseParameter):
+    def __init__(self, tensor, parent, name, range, units, locked=False):
+        self.arena = parent.linkage.arena
+        self.index = None
+        self.size = None
+        self._manual = None
+        self._backup = None
+        super(Parameter, self).__init__(tensor, parent, name, range, units, locked)
+        self.id = parent.linkage.register_parameter(self)
+
+    @property
+    def tensor(self):
+        return(self.arena.get(self.index, self.size, self.locked))
+
+    @tensor.setter
+    def tensor(self, _tensor):
+        if type(_tensor) is not list:
+            _tensor = [_tensor]
+        _tensor = torch.tensor(_tensor, dtype=self.arena.dtype).view(-1)
+        if self.index is None:
+            self.size = len(_tensor)
+            self.index = self.arena.allocate(_tensor, self.locked)
+        elif len(_tensor) != self.size:
+            raise Exception('Cannot change the size of a parameter.')
+        else:
+            self.arena.set(self.index, _tensor, self.locked)
+        self.parent.linkage.bump_param_version()
+
+    @property
+    def manual(self):
+        if self._manual is None:
+            self._manual = ManualParameter(
+                self.tensor.tolist(), self.parent, self.name, self.range, self.units, self.locked)
+        return(self._manual)
+
+    @property
+    def backup(self):
+        if self._backup is None:
+            self._backup = ManualParameter(
+                [], self.parent, self.name, self.range, self.units, self.locked)
+        return(self._backup)
+
+    def reset(self):
+        self.backup.tensor = self.manual.tensor.tolist()
+        self.manual.tensor = self.tensor.tolist()
+
+    def restore(self):
+        self.manual.tensor = self.backup.tensor.tolist()
+        self.backup.tensor = []
+
+class ManualParameter(BaseParameter):
+    def __init__(self, tensor, parent, name, range, units, locked=False):
+        super(ManualParameter, self).__init__(tensor, parent, name, range, units, locked)
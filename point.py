@@ -13,7 +13,10 @@ class Point(BaseGeometry):
     
     @property
     def r(self):
-        raise Exception('Override this property.')
+        return(self.linkage.memoize(self, 'r', self.get_r))
+
+    def get_r(self):
+        raise Exception('Override this method.')
         
     @property
     def _r(self):
@@ -22,6 +25,12 @@ class Point(BaseGeometry):
         
     def root(self):
         raise Exception('Override this method.')
+
+    def trajectory(self, driver, num_steps=TRAJECTORY_NUM_STEPS, span=None, spacing='driver'):
+        return(self.linkage.get_trajectory(self, driver, num_steps, span, spacing))
+
+    def residuals(self):
+        return(torch.zeros(0))
         
     def add_frompointline(self, L, theta, phi=None, ux=None, uz=None, locked=False):
         new_line = self.linkage.add_frompointline(self, L, theta, phi, ux, uz, locked)
@@ -46,8 +55,7 @@ class AtPoint(Point):
         print('\t', self)
         self.param_info()
     
-    @property
-    def r(self):
+    def get_r(self):
         return(torch.cat([self.params.x(), self.params.y(), self.params.z()]))
     
     def root(self):
@@ -71,8 +79,7 @@ class AnchorPoint(Point):
         print('\t', self)
         self.param_info()
         
-    @property
-    def r(self):
+    def get_r(self):
         return(torch.cat([self.params.x(), self.params.y(), self.params.z()]))
         
     def root(self):
@@ -94,8 +101,7 @@ class OnPointPoint(Point):
         print('\t', self)
         self.param_info()
         
-    @property
-    def r(self):
+    def get_r(self):
         return(self.parent.r)
     
     def root(self):
@@ -120,8 +126,7 @@ class ToPointPoint(Point):
         print('\t', self)
         self.param_info()
         
-    @property
-    def r(self):
+    def get_r(self):
         return(torch.cat([self.params.x(), self.params.y(), self.params.z()]))
     
     def root(self):
@@ -129,34 +134,51 @@ class ToPointPoint(Point):
     
     def E(self):
         return((self.r-self.parent.r).pow(2).sum())
+
+    def residuals(self):
+        return(self.r-self.parent.r)
     
 class CalculatedPoint(Point):
     def __init__(self, linkage, name, parent):
         super(CalculatedPoint, self).__init__(linkage, name)
         self.parent = parent
+        self.frame = None
     
     def info(self):
         print('\t', self)
         self.param_info()
     
-    def get_dr(self):
-        if self.parent.ux is None:
-            ax = torch.tensor([1,0,0], requires_grad=False).to(torch.float)
-        elif type(self.parent.ux) is list:
-            ax = torch.tensor(ux, requires_grad=False).to(torch.float)
-        elif type(self.parent.ux).__bases__[0].__name__ is 'Line':
-            ax = self.parent.ux.u
+    def get_axis(self, u, default):
+        if u is None:
+            return(torch.tensor(default, dtype=self.linkage.dtype, requires_grad=False))
+        elif type(u) is list:
+            return(torch.tensor(u, dtype=self.linkage.dtype, requires_grad=False))
+        elif u.type == 'line':
+            return(u.u)
         else:
-            raise Exception('ux must be None, a list, or a Line.')
-        if self.parent.uz is None:
-            az = torch.tensor([0,0,1], requires_grad=False).to(torch.float)
-        elif type(self.parent.uz) is list:
-            az = torch.tensor(uz, requires_grad=False).to(torch.float)
-        elif type(self.parent.uz).__bases__[0].__name__ is 'Line':
-            az = self.parent.uz.u
-        else:
-            raise Exception('uz must be None, a list, or a Line.')
-        ay = torch.cross(az, ax)
+            raise Exception('ux and uz must be None, a list, or a Line.')
+
+    def is_frame_constant(self):
+        for u in [self.parent.ux, self.parent.uz]:
+            if u is not None and type(u) is not list:
+                return(False)
+        return(True)
+
+    def get_frame(self):
+        if self.frame is not None:
+            return(self.frame)
+        if self.is_frame_constant():
+            self.frame = self.build_frame()
+            return(self.frame)
+        return(self.linkage.memoize(self, 'frame', self.build_frame))
+
+    def build_frame(self):
+        ax = self.get_axis(self.parent.ux, [1,0,0])
+        az = self.get_axis(self.parent.uz, [0,0,1])
+        ay = torch.cross(az, ax, dim=0)
+        return(torch.stack([ax, ay, az], dim=1))
+
+    def get_dr(self):
         theta = self.parent.params.theta()*ANGLE_FACTOR
         phi = self.parent.params.phi()*ANGLE_FACTOR
         theta = theta.view(-1,1)
@@ -165,7 +187,7 @@ class CalculatedPoint(Point):
         uy = torch.sin(phi)*torch.sin(theta)
         uz = torch.cos(phi).expand(ux.shape[0],ux.shape[1])
         dr = self.parent.L * torch.stack([ux, uy, uz], dim=2)
-        R = torch.stack([ax, ay, az], dim=1)
+        R = self.get_frame()
         dr = torch.matmul(R.unsqueeze(0).unsqueeze(0), dr.unsqueeze(3))
         dr = dr.squeeze()
         return(dr)
@@ -188,8 +210,7 @@ class CalculatedAlphaPoint(CalculatedPoint):
         print('\t', self)
         self.param_info()
         
-    @property
-    def r(self):
+    def get_r(self):
         #raise Exception('Debug this.')
         dr = self.get_dr()
         r = self.parent.p1.r + dr
@@ -207,8 +228,7 @@ class CalculatedAnteriorPoint(CalculatedPoint):
         print('\t', self)
         self.param_info()
         
-    @property
-    def r(self):
+    def get_r(self):
         dr = self.get_dr()
         if dr.dim() == 1:
             dr = dr.view(-1,3)
@@ -237,8 +257,7 @@ class CalculatedAnteriorGammaPoint(CalculatedPoint):
         print('\t', self)
         self.param_info()
         
-    @property
-    def r(self):
+    def get_r(self):
         #raise Exception('Debug this.')
         gamma = self.parent.params.gamma()
         gamma = 0.5*(1+torch.tanh(10*(gamma-0.5)))
@@ -260,8 +279,7 @@ class CalculatedPosteriorPoint(CalculatedPoint):
         print('\t', self)
         self.param_info()
 
-    @property
-    def r(self):
+    def get_r(self):
         dr = self.get_dr()
         if dr.dim() == 1:
             dr = dr.view(-1,3)
@@ -290,8 +308,7 @@ class CalculatedPosteriorGammaPoint(CalculatedPoint):
         print('\t', self)
         self.param_info()
     
-    @property
-    def r(self):
+    def get_r(self):
         #raise Exception('Debug this.')
         gamma = self.parent.params.gamma()
         gamma = 0.5*(1+torch.tanh(10*(gamma-0.5)))
@@ -316,8 +333,7 @@ class OnLinePoint(Point):
         print('\t', self)
         self.param_info()
     
-    @property
-    def r(self):
+    def get_r(self):
         alpha = self.params.alpha()
         return((1-alpha)*self.parent.p1.r+alpha*self.parent.p2.r)
     
@@ -0,0 +1,696 @@
+import torch, warnings
+from munch import Munch
+from settings import *
+
+class LinkageProgram():
+    def __init__(self, linkage, geometries=None):
+        self.linkage = linkage
+        self.version = linkage.structure_version
+        if geometries is None:
+            geometries = list(linkage.points.values())+list(linkage.lines.values())
+        self.geometries = list(geometries)
+        self.params = []
+        self.param_index = {}
+        for geom in self.geometries:
+            for param in geom.params.values():
+                self.param_index[id(param)] = len(self.params)
+                self.params.append(param)
+        self.param_names = [param.full_name for param in self.params]
+        self.geometry_index = {id(geom): i for i, geom in enumerate(self.geometries)}
+        self.arena_index = torch.tensor([param.index for param in self.params], dtype=torch.long)
+        self.free_index = torch.tensor(
+            [i for i, param in enumerate(self.params) if not param.locked], dtype=torch.long)
+        self.components = None
+        self.jacobian_pattern = None
+        self.children = None
+        self.dyads = None
+        self.fast_paths = {}
+        self.build_nodes()
+        self.build_ops()
+        self.build_residuals()
+
+    ######################################## Nodes #########################################
+
+    def canonical(self, point):
+        while point.__class__.__name__ == 'OnPointPoint':
+            point = point.parent
+        return(point)
+
+    def get_frame_lines(self, point):
+        lines = []
+        for u in [point.parent.ux, point.parent.uz]:
+            if u is not None and type(u) is not list:
+                lines.append(u)
+        return(lines)
+
+    def get_dependencies(self, point):
+        kind = point.__class__.__name__
+        if kind in ['AtPoint', 'AnchorPoint', 'ToPointPoint']:
+            return(None, [])
+        elif kind in ['CalculatedAnteriorGammaPoint', 'CalculatedPosteriorGammaPoint']:
+            return(None, [self.canonical(point.parent.parent1), self.canonical(point.parent.parent2)])
+        elif kind == 'OnLinePoint':
+            return(None, [self.canonical(point.parent.p1), self.canonical(point.parent.p2)])
+        elif kind == 'CalculatedAlphaPoint':
+            base = self.canonical(point.parent.p1)
+        elif kind in ['CalculatedAnteriorPoint', 'CalculatedPosteriorPoint']:
+            base = self.canonical(point.parent.parent)
+        else:
+            raise Exception('Cannot compile point of type {}.'.format(kind))
+        others = []
+        for line in self.get_frame_lines(point):
+            others += [self.canonical(line.p1), self.canonical(line.p2)]
+        return(base, others)
+
+    def build_nodes(self):
+        roots = []
+        for geom in self.geometries:
+            if geom.type == 'point':
+                roots.append(geom)
+        for geom in self.geometries:
+            if geom.type == 'line':
+                roots += [geom.p1, geom.p2]
+        self.nodes, self.node_index, self.level, self.base, self.deps = [], {}, {}, {}, []
+        for root in roots:
+            stack = [self.canonical(root)]
+            while stack:
+                point = stack[-1]
+                if id(point) in self.level:
+                    stack.pop()
+                    continue
+                base, others = self.get_dependencies(point)
+                deps = others if base is None else [base]+others
+                pending = [p for p in deps if id(p) not in self.level]
+                if pending:
+                    stack += pending
+                    continue
+                stack.pop()
+                level = max([self.level[id(p)]+1 for p in others]+[0])
+                if base is not None:
+                    level = max(level, self.level[id(base)])
+                    self.base[id(point)] = base
+                self.level[id(point)] = level
+                self.node_index[id(point)] = len(self.nodes)
+                self.nodes.append(point)
+                self.deps.append([self.node_index[id(p)] for p in deps])
+        self.point_rows = {}
+        for root in roots:
+            self.point_rows[root.name] = self.row(root)
+
+    def row(self, point):
+        return(self.node_index[id(self.canonical(point))])
+
+    def param(self, param):
+        return(self.param_index[id(param)])
+
+    ####################################### Program ########################################
+
+    def get_op(self, point):
+        kind = point.__class__.__name__
+        if kind in ['AtPoint', 'AnchorPoint', 'ToPointPoint']:
+            return('coords')
+        elif kind in ['CalculatedAlphaPoint', 'CalculatedAnteriorPoint', 'CalculatedPosteriorPoint']:
+            return('calculated')
+        elif kind in ['CalculatedAnteriorGammaPoint', 'CalculatedPosteriorGammaPoint']:
+            return('gamma')
+        else:
+            return('online')
+
+    def build_jumps(self, points):
+        local = {id(p): i for i, p in enumerate(points)}
+        k = len(points)
+        parent = [local.get(id(self.base[id(p)]), k) for p in points]
+        anchor = []
+        for p, i in zip(points, parent):
+            anchor.append(anchor[i] if i < k else self.row(self.base[id(p)]))
+        jumps, ptr = [], torch.tensor(parent+[k])
+        while bool((ptr[:k] != k).any()):
+            jumps.append(ptr[:k])
+            ptr = ptr[ptr]
+        return(torch.tensor(anchor), jumps)
+
+    def build_ops(self):
+        groups = {}
+        for point in self.nodes:
+            op = self.get_op(point)
+            groups.setdefault((self.level[id(point)], op == 'calculated'), []).append(point)
+        self.ops = []
+        for (level, calculated) in sorted(groups.keys()):
+            points = groups[(level, calculated)]
+            ops = ['calculated'] if calculated else ['coords', 'gamma', 'online']
+            for op in ops:
+                op_points = [p for p in points if self.get_op(p) == op]
+                if op_points:
+                    self.ops.append((op, getattr(self, 'build_{}'.format(op))(op_points)))
+
+    def build_coords(self, points):
+        return({
+            'rows': torch.tensor([self.row(p) for p in points]),
+            'params': torch.tensor([[self.param(p.params[c]) for c in 'xyz'] for p in points])})
+
+    def build_frame_axis(self, points, axis, default):
+        const, lines, line_rows = [], [], []
+        for i, point in enumerate(points):
+            u = getattr(point.parent, axis)
+            if u is None:
+                const.append(default)
+            elif type(u) is list:
+                const.append(u)
+            else:
+                const.append(default)
+                lines.append(i)
+                line_rows.append([self.row(u.p1), self.row(u.p2), float('nan') if u.L is None else u.L])
+        return({
+            'const': torch.tensor(const, dtype=torch.double),
+            'lines': torch.tensor(lines, dtype=torch.long),
+            'p1': torch.tensor([int(l[0]) for l in line_rows], dtype=torch.long),
+            'p2': torch.tensor([int(l[1]) for l in line_rows], dtype=torch.long),
+            'L': torch.tensor([l[2] for l in line_rows], dtype=torch.double)})
+
+    def build_calculated(self, points):
+        beta, a0, a1 = [], [], []
+        for point in points:
+            kind = point.__class__.__name__
+            if kind == 'CalculatedAlphaPoint':
+                beta.append(self.param(point.parent.params.theta))
+                a0.append(1.0)
+                a1.append(0.0)
+            else:
+                beta.append(self.param(point.parent.params.beta))
+                a0.append(0.0 if kind == 'CalculatedAnteriorPoint' else 1.0)
+                a1.append(-1.0)
+        anchor, jumps = self.build_jumps(points)
+        return({
+            'rows': torch.tensor([self.row(p) for p in points]),
+            'anchor': anchor,
+            'jumps': jumps,
+            'theta': torch.tensor([self.param(p.parent.params.theta) for p in points]),
+            'phi': torch.tensor([self.param(p.parent.params.phi) for p in points]),
+            'L': torch.tensor([float(p.parent.L) for p in points], dtype=torch.double),
+            'beta': torch.tensor(beta),
+            'a0': torch.tensor(a0),
+            'a1': torch.tensor(a1),
+            'ux': self.build_frame_axis(points, 'ux', [1.0,0.0,0.0]),
+            'uz': self.build_frame_axis(points, 'uz', [0.0,0.0,1.0])})
+
+    def build_gamma(self, points):
+        anterior = [p.__class__.__name__ == 'CalculatedAnteriorGammaPoint' for p in points]
+        return({
+            'rows': torch.tensor([self.row(p) for p in points]),
+            'p1': torch.tensor([self.row(p.parent.parent1) for p in points]),
+            'p2': torch.tensor([self.row(p.parent.parent2) for p in points]),
+            'base': torch.tensor([self.row(p.parent.parent1 if a else p.parent.parent2)
+                                  for p, a in zip(points, anterior)]),
+            'gamma': torch.tensor([self.param(p.parent.params.gamma) for p in points]),
+            'L': torch.tensor([float(p.parent.L) for p in points], dtype=torch.double),
+            'a0': torch.tensor([0.0 if a else 1.0 for a in anterior]),
+            'a1': torch.tensor([-1.0 for a in anterior])})
+
+    def build_online(self, points):
+        return({
+            'rows': torch.tensor([self.row(p) for p in points]),
+            'p1': torch.tensor([self.row(p.parent.p1) for p in points]),
+            'p2': torch.tensor([self.row(p.parent.p2) for p in points]),
+            'alpha': torch.tensor([self.param(p.params.alpha) for p in points])})
+
+    def eval_coords(self, data, values, r):
+        return(values[..., data['params']])
+
+    def eval_frame_axis(self, data, r):
+        a = data['const'].to(r.dtype).expand(r.shape[:-2]+data['const'].shape)
+        if len(data['lines']):
+            d = r[..., data['p2'], :]-r[..., data['p1'], :]
+            L = data['L'].to(r.dtype)
+            n = torch.where(torch.isnan(L), torch.linalg.vector_norm(d, dim=-1), L)
+            a = a.index_copy(-2, data['lines'], d/n.unsqueeze(-1))
+        return(a)
+
+    def eval_calculated(self, data, values, r):
+        ax = self.eval_frame_axis(data['ux'], r)
+        az = self.eval_frame_axis(data['uz'], r)
+        ay = torch.cross(az, ax, dim=-1)
+        theta = values[..., data['theta']]*ANGLE_FACTOR
+        phi = values[..., data['phi']]*ANGLE_FACTOR
+        u = [torch.sin(phi)*torch.cos(theta), torch.sin(phi)*torch.sin(theta), torch.cos(phi)]
+        dr = u[0].unsqueeze(-1)*ax+u[1].unsqueeze(-1)*ay+u[2].unsqueeze(-1)*az
+        dr = data['L'].to(r.dtype).unsqueeze(-1)*dr
+        c = data['a0'].to(r.dtype)+data['a1'].to(r.dtype)*values[..., data['beta']]
+        dr = c.unsqueeze(-1)*dr
+        zero = torch.zeros_like(dr[..., :1, :])
+        for ptr in data['jumps']:
+            dr = dr+torch.cat([dr, zero], dim=-2)[..., ptr, :]
+        return(r[..., data['anchor'], :]+dr)
+
+    def eval_gamma(self, data, values, r):
+        gamma = values[..., data['gamma']]
+        gamma = 0.5*(1+torch.tanh(10*(gamma-0.5)))
+        dr = r[..., data['p2'], :]-r[..., data['p1'], :]
+        u = dr/dr.pow(2).sum(-1, keepdim=True).pow(0.5)
+        R = data['L'].to(r.dtype).unsqueeze(-1)*u
+        c = data['a0'].to(r.dtype)+data['a1'].to(r.dtype)*gamma
+        return(r[..., data['base'], :]+c.unsqueeze(-1)*(R-dr))
+
+    def eval_online(self, data, values, r):
+        alpha = values[..., data['alpha']].unsqueeze(-1)
+        return((1-alpha)*r[..., data['p1'], :]+alpha*r[..., data['p2'], :])
+
+    def positions(self, values):
+        r = torch.zeros(values.shape[:-1]+(len(self.nodes), 3), dtype=values.dtype)
+        for op, data in self.ops:
+            r = r.index_copy(-2, data['rows'], getattr(self, 'eval_{}'.format(op))(data, values, r))
+        return(r)
+
+    ###################################### Residuals #######################################
+
+    def build_residuals(self):
+        self.length_lines, self.zero_length_lines, self.to_points, self.constrained_params = [], [], [], []
+        for geom in self.geometries:
+            kind = geom.__class__.__name__
+            if kind == 'FromPointsLine' and geom.target_length is not None:
+                if geom.target_length == 0:
+                    self.zero_length_lines.append(geom)
+                else:
+                    self.length_lines.append(geom)
+            elif kind == 'ToPointPoint':
+                self.to_points.append(geom)
+            if geom.type == 'line':
+                for param in geom.params.values():
+                    if param.is_constrained:
+                        self.constrained_params.append(param)
+        self.length_rows = torch.tensor(
+            [[self.row(l.p1), self.row(l.p2)] for l in self.length_lines], dtype=torch.long).view(-1,2)
+        self.zero_length_rows = torch.tensor(
+            [[self.row(l.p1), self.row(l.p2)] for l in self.zero_length_lines], dtype=torch.long).view(-1,2)
+        self.to_point_rows = torch.tensor(
+            [[self.row(p), self.row(p.parent)] for p in self.to_points], dtype=torch.long).view(-1,2)
+        self.constrained_param_index = torch.tensor(
+            [self.param(p) for p in self.constrained_params], dtype=torch.long)
+        owners = [[line] for line in self.length_lines]+[
+            3*[line] for line in self.zero_length_lines]+[
+            3*[point] for point in self.to_points]+[
+            [param.parent] for param in self.constrained_params]
+        self.residual_owners = torch.tensor(
+            [self.geometry_index[id(geom)] for geoms in owners for geom in geoms], dtype=torch.long)
+        self.update_targets()
+
+    def update_targets(self):
+        self.length_targets = torch.tensor(
+            [float(l.target_length) for l in self.length_lines], dtype=torch.double)
+        self.length_branches = torch.tensor(
+            [0 if l.branch is None else l.branch for l in self.length_lines], dtype=torch.float)
+        self.param_targets = torch.tensor(
+            [float(p.target) for p in self.constrained_params], dtype=torch.double)
+        for component in self.components or []:
+            if component.program is not None and component.program is not self:
+                component.program.update_targets()
+
+    @property
+    def num_residuals(self):
+        return(len(self.length_lines)+3*len(self.zero_length_lines)
+               +3*len(self.to_points)+len(self.constrained_params))
+
+    def residuals(self, values, r=None, length_targets=None, param_targets=None):
+        r = self.positions(values) if r is None else r
+        length_targets = self.length_targets if length_targets is None else length_targets
+        param_targets = self.param_targets if param_targets is None else param_targets
+        batch_shape = values.shape[:-1]
+        dr = r[..., self.length_rows[:,1], :]-r[..., self.length_rows[:,0], :]
+        length = dr.pow(2).sum(-1).pow(0.5)-length_targets.to(values.dtype)
+        zero_length = r[..., self.zero_length_rows[:,1], :]-r[..., self.zero_length_rows[:,0], :]
+        to_point = r[..., self.to_point_rows[:,0], :]-r[..., self.to_point_rows[:,1], :]
+        targets = values[..., self.constrained_param_index]-param_targets.to(values.dtype)
+        return(torch.cat([
+            length,
+            zero_length.reshape(batch_shape+(-1,)),
+            to_point.reshape(batch_shape+(-1,)),
+            targets], dim=-1))
+
+    def get_residual_rows(self, exclude_params=[]):
+        keep = torch.ones(self.num_residuals, dtype=torch.bool)
+        offset = self.num_residuals-len(self.constrained_params)
+        for i, index in enumerate(self.constrained_param_index.tolist()):
+            if index in exclude_params:
+                keep[offset+i] = False
+        return(keep.nonzero().view(-1))
+
+    def energy(self, values):
+        return(self.residuals(values).pow(2).sum(-1))
+
+    def geometry_energy(self, values):
+        E = torch.zeros(values.shape[:-1]+(len(self.geometries),), dtype=values.dtype)
+        return(E.index_add(-1, self.residual_owners, self.residuals(values).pow(2)))
+
+    ###################################### Components ######################################
+
+    def get_owner(self, point):
+        if self.get_op(point) in ['calculated', 'gamma']:
+            return(point.parent)
+        return(point)
+
+    def get_residual_nodes(self):
+        nodes = self.length_rows.tolist()
+        nodes += [rows for rows in self.zero_length_rows.tolist() for i in range(3)]
+        nodes += [rows for rows in self.to_point_rows.tolist() for i in range(3)]
+        nodes += [[] for param in self.constrained_params]
+        return(nodes)
+
+    def build_components(self):
+        P = len(self.params)
+        parent = list(range(P+len(self.nodes)))
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return(i)
+        def union(i, j):
+            parent[find(i)] = find(j)
+        free = set(self.free_index.tolist())
+        has_free = []
+        for n, point in enumerate(self.nodes):
+            own = [self.param(p) for p in self.get_owner(point).params.values() if self.param(p) in free]
+            deps = [P+d for d in self.deps[n] if has_free[d]]
+            for i in own+deps:
+                union(P+n, i)
+            has_free.append(bool(own or deps))
+        offset = self.num_residuals-len(self.constrained_params)
+        residual_nodes, roots = self.get_residual_nodes(), []
+        for row, nodes in enumerate(residual_nodes):
+            elements = [P+n for n in nodes if has_free[n]]
+            if row >= offset and self.constrained_param_index[row-offset].item() in free:
+                elements.append(self.constrained_param_index[row-offset].item())
+            for i in elements[1:]:
+                union(elements[0], i)
+            roots.append(elements[0] if elements else None)
+        components = {}
+        for row, root in enumerate(roots):
+            if root is not None:
+                components.setdefault(find(root), []).append(row)
+        needed = {root: set() for root in components}
+        for n in range(len(self.nodes)):
+            root = find(P+n)
+            if root in needed:
+                needed[root].add(n)
+        self.components, self.row_component = [], {}
+        for root, rows in components.items():
+            for row in rows:
+                self.row_component[row] = len(self.components)
+            nodes = needed[root]
+            for row in rows:
+                nodes.update(residual_nodes[row])
+            for n in reversed(range(len(self.nodes))):
+                if n in nodes:
+                    nodes.update(self.deps[n])
+            geometries = {id(self.get_owner(self.nodes[n])) for n in nodes}
+            geometries.update(id(self.geometries[i]) for i in self.residual_owners[rows].tolist())
+            self.components.append(Munch(
+                rows=torch.tensor(rows, dtype=torch.long),
+                free_index=torch.tensor([i for i in sorted(free) if find(i) == root], dtype=torch.long),
+                geometries=[geom for geom in self.geometries if id(geom) in geometries],
+                program=None))
+        return(self.components)
+
+    def get_components(self):
+        if self.components is None:
+            self.build_components()
+        return(self.components)
+
+    def get_component_program(self, component):
+        if component.program is None and len(component.rows) == self.num_residuals:
+            component.program = self
+        elif component.program is None:
+            component.program = LinkageProgram(self.linkage, component.geometries)
+        return(component.program)
+
+    ###################################### Downstream ######################################
+
+    def build_downstream_index(self):
+        self.children = [[] for point in self.nodes]
+        for n, deps in enumerate(self.deps):
+            for d in deps:
+                self.children[d].append(n)
+        self.param_nodes = [[] for param in self.params]
+        for n, point in enumerate(self.nodes):
+            for param in self.get_owner(point).params.values():
+                self.param_nodes[self.param(param)].append(n)
+        self.node_rows = [[] for point in self.nodes]
+        for row, nodes in enumerate(self.get_residual_nodes()):
+            for n in set(nodes):
+                self.node_rows[n].append(row)
+        offset = self.num_residuals-len(self.constrained_params)
+        self.param_rows = {index: offset+i for i, index in enumerate(self.constrained_param_index.tolist())}
+        self.line_rows = [(line.name, self.row(line.p1), self.row(line.p2))
+                          for line in self.geometries if line.type == 'line']
+
+    def get_downstream(self, params):
+        if self.children is None:
+            self.build_downstream_index()
+        stack = [n for index in params for n in self.param_nodes[index]]
+        nodes = set(stack)
+        while stack:
+            for n in self.children[stack.pop()]:
+                if n not in nodes:
+                    nodes.add(n)
+                    stack.append(n)
+        rows = {row for n in nodes for row in self.node_rows[n]}
+        rows.update(self.param_rows[index] for index in params if index in self.param_rows)
+        return(nodes, rows)
+
+    def get_affected_components(self, params):
+        components = self.get_components()
+        nodes, rows = self.get_downstream(params)
+        return([components[i] for i in sorted({self.row_component[row] for row in rows
+                                               if row in self.row_component})])
+
+    def get_affected_geometries(self, params):
+        nodes, rows = self.get_downstream(params)
+        return(Munch(
+            points={name for name, row in self.point_rows.items() if row in nodes},
+            lines={name for name, row1, row2 in self.line_rows if row1 in nodes or row2 in nodes}))
+
+    ######################################### Dyads ########################################
+
+    def is_dyad_point(self, point):
+        if point.__class__.__name__ != 'CalculatedAlphaPoint' or not point.is_frame_constant():
+            return(False)
+        if point.parent.params.theta.locked or not point.parent.params.phi.locked:
+            return(False)
+        R = point.build_frame()
+        return(bool(torch.allclose(R.T @ R, torch.eye(3, dtype=R.dtype), atol=1e-6)))
+
+    def build_dyads(self):
+        candidates, thetas = [], set()
+        for i, line in enumerate(self.length_lines):
+            for c, d in sorted([(line.p1, line.p2), (line.p2, line.p1)], key=lambda p: -self.row(p[0])):
+                c = self.canonical(c)
+                if not self.is_dyad_point(c) or self.param(c.parent.params.theta) in thetas:
+                    continue
+                theta = self.param(c.parent.params.theta)
+                nodes, rows = self.get_downstream([theta])
+                if self.row(d) in nodes:
+                    continue
+                thetas.add(theta)
+                candidates.append(Munch(index=i, theta=theta, phi=self.param(c.parent.params.phi),
+                    b=self.row(c.parent.p1), d=self.row(d), L=float(c.parent.L), R=c.build_frame(),
+                    nodes=nodes, rows=rows))
+                break
+        dyads = candidates
+        while True:
+            rows = {dyad.index for dyad in dyads}
+            valid = [dyad for dyad in dyads if dyad.rows <= rows]
+            if len(valid) == len(dyads):
+                break
+            dyads = valid
+        node_dyads = {}
+        for j, dyad in enumerate(dyads):
+            for n in dyad.nodes:
+                node_dyads.setdefault(n, set()).add(j)
+        deps = [(node_dyads.get(dyad.b, set()) | node_dyads.get(dyad.d, set()))-{i}
+                for i, dyad in enumerate(dyads)]
+        self.dyads, done = [], set()
+        while True:
+            wave = [i for i in range(len(dyads)) if i not in done and deps[i] <= done]
+            if not wave:
+                break
+            done.update(wave)
+            self.dyads.append({
+                'index': torch.tensor([dyads[i].index for i in wave]),
+                'theta': torch.tensor([dyads[i].theta for i in wave]),
+                'phi': torch.tensor([dyads[i].phi for i in wave]),
+                'b': torch.tensor([dyads[i].b for i in wave]),
+                'd': torch.tensor([dyads[i].d for i in wave]),
+                'L': torch.tensor([dyads[i].L for i in wave], dtype=torch.double),
+                'R': torch.stack([dyads[i].R for i in wave])})
+        return(self.dyads)
+
+    def get_dyads(self):
+        if self.dyads is None:
+            self.build_dyads()
+        return(self.dyads)
+
+    def solve_dyads(self, values):
+        for wave in self.get_dyads():
+            with torch.no_grad():
+                r = self.positions(values)
+            d = (r[wave['d']]-r[wave['b']]).unsqueeze(-2) @ wave['R'].to(values.dtype)
+            d = d.squeeze(-2)
+            L, phi = wave['L'].to(values.dtype), values[wave['phi']]*ANGLE_FACTOR
+            T = self.length_targets[wave['index']].to(values.dtype)
+            a, b = L*torch.sin(phi)*d[:,0], L*torch.sin(phi)*d[:,1]
+            c = 0.5*(L.pow(2)+d.pow(2).sum(-1)-T.pow(2))-L*torch.cos(phi)*d[:,2]
+            rho = (a.pow(2)+b.pow(2)).pow(0.5)
+            base = torch.atan2(b, a)
+            alpha = torch.acos((c/rho.clamp(min=XTOL)).clamp(-1, 1))
+            theta0 = values[wave['theta']]*ANGLE_FACTOR
+            delta = [torch.atan2(torch.sin(t-theta0), torch.cos(t-theta0)) for t in [base+alpha, base-alpha]]
+            branch = self.length_branches[wave['index']]
+            nearest = torch.where(delta[0].abs() <= delta[1].abs(), delta[0], delta[1])
+            delta = torch.where(branch > 0, delta[0], torch.where(branch < 0, delta[1], nearest))
+            delta = torch.where(rho > XTOL, delta, torch.zeros_like(delta))
+            values = values.index_copy(0, wave['theta'], (theta0+delta)/ANGLE_FACTOR)
+        return(values)
+
+    ####################################### Jacobian #######################################
+
+    def get_node_params(self):
+        position = {i: k for k, i in enumerate(self.free_index.tolist())}
+        node_params = []
+        for n, point in enumerate(self.nodes):
+            params = {position[self.param(p)] for p in self.get_owner(point).params.values()
+                      if self.param(p) in position}
+            for d in self.deps[n]:
+                params |= node_params[d]
+            node_params.append(params)
+        return(node_params, position)
+
+    def build_jacobian_pattern(self):
+        node_params, position = self.get_node_params()
+        offset = self.num_residuals-len(self.constrained_params)
+        row_cols = []
+        for row, nodes in enumerate(self.get_residual_nodes()):
+            cols = set().union(*[node_params[n] for n in nodes])
+            if row >= offset and self.constrained_param_index[row-offset].item() in position:
+                cols.add(position[self.constrained_param_index[row-offset].item()])
+            row_cols.append(sorted(cols))
+        col_rows = [[] for i in range(len(self.free_index))]
+        for row, cols in enumerate(row_cols):
+            for col in cols:
+                col_rows[col].append(row)
+        colors = []
+        for col, rows in enumerate(col_rows):
+            used = {colors[c] for row in rows for c in row_cols[row] if c < col}
+            color = 0
+            while color in used:
+                color += 1
+            colors.append(color)
+        num_colors = max(colors)+1 if colors else 0
+        rows = torch.tensor([row for row, cols in enumerate(row_cols) for col in cols], dtype=torch.long)
+        cols = torch.tensor([col for cols in row_cols for col in cols], dtype=torch.long)
+        colors = torch.tensor(colors, dtype=torch.long)
+        seeds = torch.zeros(num_colors, len(colors))
+        seeds[colors, torch.arange(len(colors))] = 1.0
+        shape = (self.num_residuals, len(self.free_index))
+        self.jacobian_pattern = Munch(rows=rows, cols=cols, colors=colors, seeds=seeds, shape=shape,
+            density=len(rows)/max(shape[0]*shape[1], 1))
+        return(self.jacobian_pattern)
+
+    def get_jacobian_pattern(self):
+        if self.jacobian_pattern is None:
+            self.build_jacobian_pattern()
+        return(self.jacobian_pattern)
+
+    def use_sparse_jacobian(self):
+        if len(self.free_index) < SPARSE_MIN_NUM_PARAMS:
+            return(False)
+        return(self.get_jacobian_pattern().density <= SPARSE_MAX_DENSITY)
+
+    ##################################### Interference #####################################
+
+    def get_lines(self):
+        return([geom for geom in self.geometries if geom.type == 'line'])
+
+    def get_segment_rows(self):
+        return(torch.tensor([[self.row(line.p1), self.row(line.p2)] for line in self.get_lines()],
+                            dtype=torch.long).view(-1, 2))
+
+    def get_connected_lines(self):
+        lines = self.get_lines()
+        attached = [{self.row(line.p1), self.row(line.p2)} for line in lines]
+        line_index = {id(line): k for k, line in enumerate(lines)}
+        for k, line in enumerate(lines):
+            for parent in [getattr(line, name, None) for name in ['parent', 'parent1', 'parent2']]:
+                if parent is not None and id(self.canonical(parent)) in self.node_index:
+                    attached[k].add(self.row(parent))
+        for n, point in enumerate(self.nodes):
+            if self.get_op(point) == 'online' and id(point.parent) in line_index:
+                attached[line_index[id(point.parent)]].add(n)
+        row_lines = {}
+        for k, rows in enumerate(attached):
+            for row in rows:
+                row_lines.setdefault(row, []).append(k)
+        pairs = {(i, j) for ks in row_lines.values() for i in ks for j in ks if i < j}
+        return(torch.tensor(sorted(pairs), dtype=torch.long).view(-1, 2))
+
+    def get_segments(self, values):
+        rows = self.get_segment_rows()
+        with torch.no_grad():
+            r = self.positions(values)
+        return(r[..., rows, :])
+
+    ###################################### Fast path #######################################
+
+    def target_energy(self, values, length_targets, param_targets):
+        return(self.residuals(values, None, length_targets, param_targets).pow(2).sum(-1))
+
+    def build_fast_path(self, mode, values):
+        targets = (self.length_targets.to(values.dtype), self.param_targets.to(values.dtype))
+        if mode == 'trace':
+            example = values.detach().clone().requires_grad_(True)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                return(torch.jit.trace(self.target_energy, (example,)+targets, check_trace=False))
+        else:
+            return(torch.compile(self.target_energy, dynamic=False))
+
+    def get_fast_energy(self, mode=FAST_PATH):
+        if mode is None:
+            return(self.energy)
+        elif mode not in ['trace', 'compile']:
+            raise Exception('Fast path must be None, trace or compile.')
+        def energy(values):
+            key = (mode, tuple(values.shape), values.dtype)
+            targets = (self.length_targets.to(values.dtype), self.param_targets.to(values.dtype))
+            fn = self.fast_paths.get(key)
+            if fn is None:
+                try:
+                    fn = self.build_fast_path(mode, values)
+                    E = fn(values, *targets)
+                except Exception as e:
+                    warnings.warn('Falling back to the eager energy: {}'.format(e))
+                    fn = self.target_energy
+                    E = fn(values, *targets)
+                self.fast_paths[key] = fn
+                return(E)
+            return(fn(values, *targets))
+        return(energy)
+
+    def energy_and_grad(self, values, mode=FAST_PATH):
+        x = values.detach()[self.free_index].requires_grad_(True)
+        E = self.get_fast_energy(mode)(values.detach().index_copy(0, self.free_index, x))
+        grad, = torch.autograd.grad(E, x)
+        return(E.detach(), grad)
+
+    ####################################### Values #########################################
+
+    def get_values(self):
+        return(self.linkage.arena.get_values(self.arena_index))
+
+    def set_values(self, values, index=None):
+        index = self.free_index if index is None else torch.as_tensor(index, dtype=torch.long)
+        self.linkage.arena.set_values(values.detach()[index], self.arena_index[index])
+        self.linkage.bump_param_version()
+
+    def get_positions(self, names=None):
+        names = list(self.point_rows.keys()) if names is None else names
+        with torch.no_grad():
+            r = self.positions(self.get_values())
+        return(r[..., [self.point_rows[name] for name in names], :])
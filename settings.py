@@ -3,9 +3,42 @@ FIGSIZE = 4.5
 XTOL = 1.0e-06
 LEARNING_RATE = 0.01
 TOLERANCE = 0.1
+SOLVER = 'lm' #sgd
+COMPILED = True
+CACHE = True
+DECOMPOSE = True
+CLOSED_FORM = True
+FAST_PATH = None #'trace', 'compile'
+PRECISION = 'float64' #'float32', 'mixed'
+MIXED_XTOL = 1.0e-04
+MIXED_REFINE_NUM_ITER = 10
+ARENA_CAPACITY = 64
+MAX_NUM_EPOCHS = 10000
+LM_MAX_NUM_ITERATIONS = 100
+LM_DAMPING = 1.0e-03
+LM_MAX_DAMPING_DECREASE = 30.0
+SPARSE_MIN_NUM_PARAMS = 200
+SPARSE_MAX_DENSITY = 0.05
+STAGNATION_WINDOW = 500
+STAGNATION_TOLERANCE = 1.0e-06
+CONTINUATION = False
+CONTINUATION_STEP_SIZE = 0.1
+CONTINUATION_MIN_STEP_SIZE = 1.0e-04
+CONTINUATION_MAX_STEP_SIZE = 0.5
+CONTINUATION_MAX_DISTANCE = 0.25
+CONTINUATION_MAX_CORRECTOR_ITERATIONS = 5
+TRAJECTORY_NUM_STEPS = 360
 N_UPDATE = 1000
+ASYNC_SOLVE = False
+FRAME_RATE = 30
 ANGLE_FACTOR = 1
 NUM_PARAM_STEPS = 10 #1000
+ENERGY_PLOT_RESOLUTION = 200
+ENERGY_SLICE_CHUNK_SIZE = 10000
+ENERGY_MEMORY_BUDGET = 2**28
+ENERGY_LANDSCAPE_CHUNK_SIZE = 2**20
+STUDY_CHUNK_SIZE = 64
+STUDY_START_METHOD = 'spawn'
 STEP_SIZE = 0.1
 NUM_CONTOUR_LEVELS = 100
 CMAP = 'coolwarm' #gnuplot #gist_stern #coolwarm
\ No newline at end of file
@@ -0,0 +1,296 @@
+import torch, scipy.sparse, scipy.sparse.linalg
+import torch.autograd.forward_ad as fwAD
+from munch import Munch
+from settings import *
+from telemetry import SolveTrace
+
+def jacobian(residuals, params):
+    n = sum([param.numel() for param in params])
+    if len(residuals) == 0 or n == 0:
+        return(torch.zeros(len(residuals), n))
+    grad_outputs = torch.eye(len(residuals), dtype=residuals.dtype)
+    grads = torch.autograd.grad(residuals, params, grad_outputs=grad_outputs,
+        is_grads_batched=True, allow_unused=True)
+    J = []
+    for param, grad in zip(params, grads):
+        if grad is None:
+            grad = torch.zeros(len(residuals), param.numel(), dtype=residuals.dtype)
+        J.append(grad.reshape(len(residuals), -1))
+    return(torch.cat(J, dim=1))
+
+def sparse_jacobian(residual_fn, x, pattern):
+    num_colors = len(pattern.seeds)
+    if num_colors == 0:
+        with torch.no_grad():
+            r = residual_fn(x.unsqueeze(0))[0]
+        return(r, scipy.sparse.csr_matrix(pattern.shape))
+    with fwAD.dual_level():
+        x = fwAD.make_dual(x.detach().expand(num_colors, -1).clone(), pattern.seeds.to(x.dtype))
+        r, dr = fwAD.unpack_dual(residual_fn(x))
+    data = dr[pattern.colors[pattern.cols], pattern.rows].to(torch.double)
+    J = scipy.sparse.csr_matrix((data.numpy(), (pattern.rows.numpy(), pattern.cols.numpy())),
+        shape=pattern.shape)
+    return(r[0].detach(), J)
+
+def get_normal_equations(J, r):
+    r = r.to(torch.double)
+    if scipy.sparse.issparse(J):
+        return((J.T @ J).tocsc(), torch.from_numpy(J.T @ r.numpy()))
+    J = J.to(torch.double)
+    return(J.T @ J, J.T @ r)
+
+def solve_damped(A, g, mu, D):
+    if scipy.sparse.issparse(A):
+        A = A+scipy.sparse.diags(mu*D.numpy(), format='csc')
+        return(torch.from_numpy(scipy.sparse.linalg.spsolve(A, -g.numpy())))
+    return(torch.linalg.solve(A + mu*torch.diag(D), -g))
+
+class LeastSquaresProblem():
+    def __init__(self, params, residual_fn, changed=None, index=None):
+        self.params = list(params)
+        self.residual_fn = residual_fn
+        self.changed = changed
+        self.index = index
+
+    @property
+    def num_params(self):
+        if self.index is not None:
+            return(len(self.index))
+        return(sum([param.numel() for param in self.params]))
+
+    def get_values(self):
+        if not self.params:
+            return(torch.zeros(0))
+        return(torch.cat([param.detach().reshape(-1) for param in self.params]))
+
+    def get_x(self):
+        x = self.get_values()
+        if self.index is not None:
+            return(x[self.index])
+        return(x)
+
+    def set_x(self, x):
+        if self.index is not None:
+            x = self.get_values().index_copy(0, self.index, x)
+        offset = 0
+        with torch.no_grad():
+            for param in self.params:
+                n = param.numel()
+                param.copy_(x[offset:offset+n].view_as(param))
+                offset += n
+        if self.changed is not None:
+            self.changed()
+
+    def residuals(self):
+        with torch.no_grad():
+            return(self.residual_fn())
+
+    def linearize(self):
+        r = self.residual_fn()
+        J = jacobian(r, self.params)
+        if self.index is not None:
+            J = J[:, self.index]
+        return(r.detach(), J)
+
+class ProgramProblem():
+    def __init__(self, program, values=None, sparse=None):
+        self.program = program
+        self.values = program.get_values() if values is None else values
+        self.free_index = program.free_index
+        self.sparse = program.use_sparse_jacobian() if sparse is None else sparse
+
+    @property
+    def num_params(self):
+        return(len(self.free_index))
+
+    def get_x(self):
+        return(self.values[self.free_index])
+
+    def set_x(self, x):
+        self.values = self.values.index_copy(0, self.free_index, x)
+
+    def residuals(self):
+        with torch.no_grad():
+            return(self.program.residuals(self.values))
+
+    def linearize(self):
+        if self.sparse:
+            return(sparse_jacobian(self.batched_residuals, self.get_x(), self.program.get_jacobian_pattern()))
+        x = self.get_x().clone().requires_grad_(True)
+        r = self.program.residuals(self.values.index_copy(0, self.free_index, x))
+        J = jacobian(r, [x])
+        return(r.detach(), J)
+
+    def batched_residuals(self, x):
+        values = self.values.expand(x.shape[:-1]+self.values.shape)
+        return(self.program.residuals(values.index_copy(-1, self.free_index, x)))
+
+def levenberg_marquardt(problem, max_num_iter=LM_MAX_NUM_ITERATIONS, xtol=XTOL,
+                        damping=LM_DAMPING, callback=None, trace=None):
+    trace = SolveTrace('lm') if trace is None else trace
+    x = problem.get_x()
+    with trace.timer('backward'):
+        r, J = problem.linearize()
+    cost = r.pow(2).sum().item()
+    result = Munch(num_iter=0, cost=cost, converged=False, cancelled=False,
+                   reason='max_iterations', trace=trace)
+    if problem.num_params == 0 or len(r) == 0:
+        result.converged = True
+        result.reason = 'tolerance'
+        trace.finish(result.reason)
+        return(result)
+    if cost != cost:
+        result.reason = 'nan'
+        trace.finish(result.reason)
+        return(result)
+    A, g = get_normal_equations(J, r)
+    r = r.to(torch.double)
+    mu, nu = damping * max(float(A.diagonal().max()), xtol), 2.0
+    for i in range(max_num_iter):
+        result.num_iter = i+1
+        if r.abs().max().item() <= xtol:
+            result.converged, result.reason = True, 'tolerance'
+            break
+        if g.abs().max().item() <= xtol**2:
+            result.reason = 'gradient_tolerance'
+            break
+        with trace.timer('step'):
+            D = torch.ones_like(g)
+            dx = solve_damped(A, g, mu, D)
+        if dx.norm().item() <= xtol**2:
+            result.reason = 'step_tolerance'
+            break
+        x_new = x + dx.to(x.dtype)
+        with trace.timer('forward'):
+            problem.set_x(x_new)
+            r_new = problem.residuals().to(torch.double)
+        cost_new = r_new.pow(2).sum().item()
+        predicted = (dx @ (mu*D*dx - g)).item()
+        rho = (cost-cost_new)/predicted if predicted > 0 else -1
+        if cost_new == cost_new and rho > 0:
+            x, cost = x_new, cost_new
+            with trace.timer('backward'):
+                r, J = problem.linearize()
+            A, g = get_normal_equations(J, r)
+            r = r.to(torch.double)
+            mu *= max(1/LM_MAX_DAMPING_DECREASE, 1-(2*rho-1)**3)
+            nu = 2.0
+        else:
+            problem.set_x(x)
+            mu *= nu
+            nu *= 2
+        if trace.record(cost, g.norm().item(), dx.norm().item()):
+            result.reason = 'callback'
+            break
+        if callback is not None and callback(i, cost):
+            result.cancelled, result.reason = True, 'cancelled'
+            break
+    result.cost = cost
+    trace.finish(result.reason)
+    return(result)
+
+def batched_jacobian(residual_fn, x):
+    x = x.detach().requires_grad_(True)
+    r = residual_fn(x)
+    B, m = r.shape
+    if m == 0 or x.shape[-1] == 0:
+        return(r.detach(), torch.zeros(B, m, x.shape[-1], dtype=r.dtype))
+    grad_outputs = torch.eye(m, dtype=r.dtype).unsqueeze(1).expand(m, B, m)
+    J = torch.autograd.grad(r, x, grad_outputs=grad_outputs, is_grads_batched=True)[0]
+    return(r.detach(), J.permute(1, 0, 2))
+
+def batched_levenberg_marquardt(residual_fn, x, max_num_iter=LM_MAX_NUM_ITERATIONS, xtol=XTOL,
+                                damping=LM_DAMPING):
+    B, n = x.shape
+    r, J = batched_jacobian(residual_fn, x)
+    stopped = torch.zeros(B, dtype=torch.bool)
+    if n == 0 or r.shape[-1] == 0:
+        return(Munch(x=x, residuals=r, num_iter=0, converged=~stopped))
+    J, r = J.to(torch.double), r.to(torch.double)
+    A, g = J.transpose(1, 2) @ J, (J.transpose(1, 2) @ r.unsqueeze(-1)).squeeze(-1)
+    cost = r.pow(2).sum(-1)
+    mu = damping * A.diagonal(dim1=1, dim2=2).max(-1).values.clamp(min=xtol)
+    nu = torch.full((B,), 2.0, dtype=torch.double)
+    I = torch.eye(n, dtype=torch.double)
+    num_iter = 0
+    for i in range(max_num_iter):
+        num_iter = i+1
+        stopped = stopped | (r.abs().max(-1).values <= xtol) | (g.abs().max(-1).values <= xtol**2)
+        if bool(stopped.all()):
+            break
+        dx = torch.linalg.solve(A + mu.view(-1,1,1)*I, -g.unsqueeze(-1)).squeeze(-1)
+        stopped = stopped | (dx.norm(dim=-1) <= xtol**2)
+        dx = torch.where(stopped.unsqueeze(-1), torch.zeros_like(dx), dx)
+        x_new = x + dx.to(x.dtype)
+        with torch.no_grad():
+            r_new = residual_fn(x_new).to(torch.double)
+        cost_new = r_new.pow(2).sum(-1)
+        predicted = (dx * (mu.unsqueeze(-1)*dx - g)).sum(-1)
+        rho = torch.where(predicted > 0, (cost-cost_new)/predicted, torch.full_like(cost, -1.0))
+        accept = (rho > 0) & ~torch.isnan(cost_new) & ~stopped
+        x = torch.where(accept.unsqueeze(-1), x_new, x)
+        if bool(accept.any()):
+            r_lin, J_lin = batched_jacobian(residual_fn, x)
+            r_lin, J_lin = r_lin.to(torch.double), J_lin.to(torch.double)
+            r = torch.where(accept.unsqueeze(-1), r_lin, r)
+            J = torch.where(accept.view(-1,1,1), J_lin, J)
+            A, g = J.transpose(1, 2) @ J, (J.transpose(1, 2) @ r.unsqueeze(-1)).squeeze(-1)
+            cost = r.pow(2).sum(-1)
+        rho = rho.clamp(min=0.0)
+        mu = torch.where(accept, mu*torch.clamp(1-(2*rho-1)**3, min=1/LM_MAX_DAMPING_DECREASE), mu*nu)
+        nu = torch.where(accept, torch.full_like(nu, 2.0), nu*2)
+    converged = r.abs().max(-1).values <= xtol
+    return(Munch(x=x, residuals=r.to(x.dtype), num_iter=num_iter, converged=converged))
+
+def linearize_driven(residual_fn, x, t):
+    x = x.detach().clone().requires_grad_(True)
+    t = torch.tensor([t], dtype=x.dtype, requires_grad=True)
+    r = residual_fn(x, t)
+    J = jacobian(r, [x, t]).to(torch.double)
+    return(r.detach().to(torch.double), J[:, :-1], J[:, -1])
+
+def predictor_corrector(residual_fn, x, t, t_end, step_size=CONTINUATION_STEP_SIZE,
+                        min_step_size=CONTINUATION_MIN_STEP_SIZE, max_step_size=CONTINUATION_MAX_STEP_SIZE,
+                        max_distance=CONTINUATION_MAX_DISTANCE,
+                        max_num_corrector_iter=CONTINUATION_MAX_CORRECTOR_ITERATIONS, xtol=XTOL):
+    direction = 1.0 if t_end >= t else -1.0
+    path = Munch(t=[t], x=[x], num_iter=0, num_rejected=0, reason='complete')
+    h = step_size
+    r, Jx, Jt = linearize_driven(residual_fn, x, t)
+    while direction*(t_end-t) > xtol:
+        tangent = -torch.linalg.pinv(Jx) @ Jt
+        h = min(h, abs(t_end-t), max_distance/max(tangent.norm().item(), xtol))
+        t_new = t+direction*h
+        x_pred = x.to(torch.double)+direction*h*tangent
+        x_new, converged, cost = x_pred, False, float('inf')
+        for i in range(max_num_corrector_iter):
+            r_new, Jx_new, Jt_new = linearize_driven(residual_fn, x_new.to(x.dtype), t_new)
+            cost_new = r_new.pow(2).sum().item()
+            if not cost_new < cost:
+                break
+            cost = cost_new
+            if r_new.abs().max().item() <= xtol:
+                converged = True
+                break
+            dx = -torch.linalg.pinv(Jx_new) @ r_new
+            x_new = x_new+dx
+            path.num_iter += 1
+            if dx.norm().item() <= xtol*(1+x_new.norm().item()):
+                r_new, Jx_new, Jt_new = linearize_driven(residual_fn, x_new.to(x.dtype), t_new)
+                converged = True
+                break
+        drift = (x_new-x_pred).norm().item()
+        if converged and drift <= max(0.5*h*tangent.norm().item(), xtol**0.5):
+            x, t = x_new.to(x.dtype), t_new
+            r, Jx, Jt = r_new, Jx_new, Jt_new
+            path.t.append(t)
+            path.x.append(x)
+            if i <= 1:
+                h = min(2*h, max_step_size)
+        else:
+            path.num_rejected += 1
+            h = h/2
+            if h < min_step_size:
+                path.reason = 'min_step_size'
+                break
+    return(path)
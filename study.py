@@ -0,0 +1,82 @@
+import numpy as np
+import torch, itertools, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from munch import Munch
+from settings import *
+from model import LinkageModel
+
+######################################## Worker ########################################
+
+worker = None
+
+def init_worker(description, names):
+    global worker
+    torch.set_num_threads(1)
+    worker = StudyWorker(description, names)
+
+def run_chunk(samples):
+    return(worker.run(samples))
+
+class StudyWorker():
+    def __init__(self, description, names):
+        self.linkage = LinkageModel.from_description(description)
+        for name in names:
+            param = self.linkage.get_parameter(name)
+            if param.is_constrained:
+                param.unconstrained()
+            if not param.locked:
+                param.lock()
+        self.program = self.linkage.compile()
+        self.columns = torch.tensor([self.program.param(self.linkage.get_parameter(name)) for name in names],
+                                    dtype=torch.long)
+        self.base = self.linkage.save_params()
+
+    def run(self, samples):
+        point_names = list(self.program.point_rows.keys())
+        dtype = self.linkage.numpy_dtype
+        results = Munch(
+            param_values=np.zeros((len(samples), len(self.program.params)), dtype=dtype),
+            positions=np.zeros((len(samples), len(point_names), 3), dtype=dtype),
+            energy=np.zeros(len(samples), dtype=dtype),
+            converged=np.zeros(len(samples), dtype=bool),
+            num_iter=np.zeros(len(samples), dtype=np.int64),
+            param_names=self.program.param_names,
+            point_names=point_names)
+        for i, sample in enumerate(samples):
+            self.linkage.restore_params(self.base)
+            values = self.program.get_values()
+            values[self.columns] = torch.as_tensor(sample, dtype=values.dtype)
+            self.program.set_values(values, index=self.columns)
+            result = self.linkage.update()
+            values = self.program.get_values()
+            with torch.no_grad():
+                results.energy[i] = self.program.energy(values).item()
+            results.param_values[i] = values.numpy()
+            results.positions[i] = self.program.get_positions(point_names).numpy()
+            results.converged[i] = result.converged
+            results.num_iter[i] = result.num_iter
+        return(results)
+
+######################################### Study ########################################
+
+def make_grid(axes):
+    return(np.array(list(itertools.product(*axes)), dtype=float).reshape(-1, len(axes)))
+
+def run_study(linkage, names, samples, max_workers=None, chunk_size=STUDY_CHUNK_SIZE):
+    description = linkage.describe() if isinstance(linkage, LinkageModel) else linkage
+    samples = np.asarray(samples, dtype=float).reshape(-1, len(names))
+    chunks = [samples[i:i+chunk_size] for i in range(0, len(samples), chunk_size)]
+    if max_workers == 1:
+        init_worker(description, names)
+        results = [run_chunk(chunk) for chunk in chunks]
+    else:
+        context = multiprocessing.get_context(STUDY_START_METHOD)
+        with ProcessPoolExecutor(max_workers, mp_context=context, initializer=init_worker,
+                                 initargs=(description, names)) as executor:
+            results = list(executor.map(run_chunk, chunks))
+    study = Munch(names=list(names), samples=samples,
+                  param_names=results[0].param_names if results else [],
+                  point_names=results[0].point_names if results else [])
+    for key in ['param_values', 'positions', 'energy', 'converged', 'num_iter']:
+        study[key] = np.concatenate([result[key] for result in results]) if results else np.zeros(0)
+    return(study)
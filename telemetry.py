@@ -0,0 +1,63 @@
+import numpy as np
+import time
+from contextlib import contextmanager
+from munch import Munch
+from settings import *
+
+class SolveTrace():
+    def __init__(self, solver, callbacks=[]):
+        self.solver = solver
+        self.callbacks = list(callbacks)
+        self.energy, self.grad_norm, self.step_size, self.wall_time = [], [], [], []
+        self.timings = {'compile': 0.0, 'forward': 0.0, 'backward': 0.0, 'step': 0.0, 'plot': 0.0,
+                        'total': 0.0}
+        self.reason = None
+        self.error = None
+        self.start = time.perf_counter()
+
+    def __repr__(self):
+        return('SolveTrace(solver={}, num_iter={}, reason={}, energy={})'.format(
+            self.solver, self.num_iter, self.reason, self.energy[-1] if self.energy else None))
+
+    @property
+    def num_iter(self):
+        return(len(self.energy))
+
+    @contextmanager
+    def timer(self, section):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[section] += time.perf_counter()-t0
+
+    def record(self, energy, grad_norm, step_size):
+        self.energy.append(float(energy))
+        self.grad_norm.append(float(grad_norm))
+        self.step_size.append(float(step_size))
+        self.wall_time.append(time.perf_counter()-self.start)
+        stop = False
+        for callback in self.callbacks:
+            stop = bool(callback(self)) or stop
+        return(stop)
+
+    def is_stagnating(self, window=STAGNATION_WINDOW, tolerance=STAGNATION_TOLERANCE):
+        if len(self.energy) <= window:
+            return(False)
+        E0, E1 = self.energy[-window-1], self.energy[-1]
+        return(E0-E1 <= tolerance*max(abs(E0), XTOL))
+
+    def finish(self, reason, error=None):
+        self.reason = reason
+        self.error = error
+        self.timings['total'] = time.perf_counter()-self.start
+        return(self)
+
+    def to_arrays(self):
+        return(Munch(
+            energy=np.array(self.energy),
+            grad_norm=np.array(self.grad_norm),
+            step_size=np.array(self.step_size),
+            wall_time=np.array(self.wall_time),
+            timings=dict(self.timings),
+            reason=self.reason))
@@ -0,0 +1,37 @@
+import torch
+from interference import find_interference, segment_distance
+
+def get_random_segments(num_steps, num_segments, length=1.5, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    start = torch.rand(num_steps, num_segments, 3, generator=generator, dtype=torch.double)*10
+    direction = torch.randn(num_steps, num_segments, 3, generator=generator, dtype=torch.double)
+    start[..., 2], direction[..., 2] = 0, 0
+    end = start+length*direction/direction.norm(dim=-1, keepdim=True)
+    return(torch.stack([start, end], dim=-2))
+
+def test_segment_distance_matches_sampling():
+    segments = get_random_segments(1, 60)[0]
+    a, b = segments[:30], segments[30:]
+    s = torch.linspace(0, 1, 401, dtype=torch.double).view(1,-1,1)
+    pa, pb = a[:, :1]+s*(a[:, 1:]-a[:, :1]), b[:, :1]+s*(b[:, 1:]-b[:, :1])
+    sampled = (pa.unsqueeze(2)-pb.unsqueeze(1)).norm(dim=-1).flatten(1).min(-1).values
+    exact = segment_distance(a[:, 0], a[:, 1], b[:, 0], b[:, 1])
+    assert (exact <= sampled+1.0e-12).all()
+    assert (sampled-exact).max() < 1.0e-2
+
+def test_segment_distance_degenerate():
+    p = torch.tensor([[0.0,0,0], [0,0,0], [0,0,0]], dtype=torch.double)
+    q = torch.tensor([[1.0,0,0], [0,0,0], [2,0,0]], dtype=torch.double)
+    u = torch.tensor([[0.0,1,0], [3,4,0], [0,1,0]], dtype=torch.double)
+    v = torch.tensor([[1.0,1,0], [3,4,0], [1,1,0]], dtype=torch.double)
+    assert torch.allclose(segment_distance(p, q, u, v), torch.tensor([1.0, 5.0, 1.0], dtype=torch.double))
+
+def test_sweep_and_prune_matches_brute_force():
+    segments = get_random_segments(4, 40)
+    clearance = 0.2
+    result = find_interference(segments, clearance)
+    i, j = torch.triu_indices(40, 40, 1)
+    distance = segment_distance(segments[:, i, 0], segments[:, i, 1], segments[:, j, 0], segments[:, j, 1])
+    expected = {(step, int(i[k]), int(j[k])) for step, k in (distance < clearance).nonzero().tolist()}
+    assert expected
+    assert {tuple(hit) for hit in result.hits.tolist()} == expected
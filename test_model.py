@@ -0,0 +1,206 @@
+import torch
+import numpy as np
+from model import LinkageModel
+from benchmark import (
+    build_three_bar_linkage, build_four_bar_linkage, build_linear_to_angular_linkage,
+    build_broadcasting_linkage, build_chain_linkage, build_ring_linkage)
+
+def get_points(linkage):
+    return(list(linkage.points.values())+[p for l in linkage.lines.values() for p in [l.p1, l.p2]])
+
+def test_compiled_positions_match_eager():
+    for build in [build_three_bar_linkage, build_linear_to_angular_linkage, build_broadcasting_linkage]:
+        linkage = build(LinkageModel())
+        program = linkage.compile()
+        positions = program.positions(program.get_values())
+        for point in get_points(linkage):
+            assert torch.allclose(positions[program.row(point)], point.r.detach(), atol=1.0e-12)
+
+def test_compile_frame_axis_from_points_line():
+    linkage = LinkageModel()
+    A = linkage.add_anchorpoint(at=[0,0,0])
+    B = linkage.add_anchorpoint(at=[1,1,0])
+    ab = linkage.add_frompointsline(A, B)
+    bc = B.add_frompointline(L=2, theta=30, ux=ab)
+    program = linkage.compile()
+    positions = program.positions(program.get_values())
+    assert torch.allclose(positions[program.row(bc.p2)], bc.p2.r.detach())
+
+def test_switch_precision_after_render():
+    linkage = LinkageModel()
+    A = linkage.add_anchorpoint(at=[0,0,0])
+    ab = A.add_frompointline(L=2, theta=30)
+    r = ab.p2.r.detach()
+    linkage.precision = 'float32'
+    assert ab.p2.r.dtype == torch.float
+    assert torch.allclose(ab.p2.r.detach().double(), r, atol=1.0e-6)
+
+def build_infeasible_linkage(linkage):
+    A = linkage.add_anchorpoint(at=[0,0,0])
+    D = linkage.add_anchorpoint(at=[10,0,0])
+    ab = A.add_frompointline(L=2, theta=0)
+    bc = ab.p2.add_frompointline(L=3, theta=45)
+    cd = linkage.add_frompointsline(bc.p2, D)
+    with linkage.solve_off():
+        cd.constrain_length(L=4.5)
+    return(linkage)
+
+def test_lm_reports_unconverged_residual():
+    linkage = build_infeasible_linkage(LinkageModel())
+    linkage.decompose = False
+    result = linkage.update()
+    assert not result.converged
+    assert result.reason != 'tolerance'
+
+def build_four_bars(linkage, num):
+    with linkage.solve_off():
+        for i in range(num):
+            A = linkage.add_anchorpoint(at=[2,6*i,0])
+            D = linkage.add_anchorpoint(at=[-2,6*i,0])
+            ab = A.add_frompointline(L=2, theta=0.3*i)
+            bc = ab.p2.add_frompointline(L=3, theta=135)
+            linkage.add_frompointsline(bc.p2, D).constrain_length(L=4)
+            ab.params.theta.lock()
+    return(linkage)
+
+def test_decomposed_solve_matches_monolithic():
+    values = []
+    for decompose in [True, False]:
+        linkage = build_four_bars(LinkageModel(), 3)
+        linkage.decompose, linkage.closed_form = decompose, False
+        result = linkage.update()
+        assert result.converged
+        values.append(linkage.compile().get_values())
+    assert len(linkage.compile().get_components()) == 3
+    assert torch.allclose(values[0], values[1], atol=1.0e-9)
+
+def test_closed_form_dyads_match_lm():
+    values, num_iter = [], []
+    for closed_form in [True, False]:
+        linkage = build_four_bars(LinkageModel(), 3)
+        linkage.closed_form = closed_form
+        result = linkage.update()
+        assert result.converged
+        values.append(linkage.compile().get_values())
+        num_iter.append(linkage.trace.num_iter)
+    assert num_iter[0] == 0 and num_iter[1] > 0
+    assert torch.allclose(values[0], values[1], atol=1.0e-6)
+
+def test_components_report_worst_reason():
+    linkage = LinkageModel()
+    with linkage.solve_off():
+        A = linkage.add_anchorpoint(at=[0,5,0])
+        B = linkage.add_anchorpoint(at=[5,5,0])
+        point = A
+        for i in range(10):
+            point = point.add_frompointline(L=1, theta=10*(i%2)).p2
+        linkage.add_frompointsline(point, B).constrain_length(1)
+    build_infeasible_linkage(linkage)
+    linkage.decompose = True
+    result = linkage.update(max_num_epochs=2)
+    assert result.num_components == 2
+    assert not result.converged
+    assert result.reason == 'max_iterations'
+
+def test_remove_length_constraint():
+    linkage = LinkageModel()
+    A = linkage.add_anchorpoint(at=[2,0,0])
+    D = linkage.add_anchorpoint(at=[-2,0,0])
+    ab = A.add_frompointline(L=2, theta=0)
+    bc = ab.p2.add_frompointline(L=3, theta=135)
+    cd = linkage.add_frompointsline(bc.p2, D)
+    cd.constrain_length(L=4)
+    assert linkage.compile().num_residuals == 1
+    cd.constrain_length(None)
+    assert linkage.compile().num_residuals == 0
+    assert linkage.update().converged
+
+def test_study_overrides_parameter_constraint():
+    from study import run_study
+    linkage = LinkageModel()
+    A = linkage.add_anchorpoint(at=[2,0,0])
+    D = linkage.add_anchorpoint(at=[-2,0,0])
+    ab = A.add_frompointline(L=2, theta=0)
+    bc = ab.p2.add_frompointline(L=3, theta=135)
+    cd = linkage.add_frompointsline(bc.p2, D)
+    cd.constrain_length(L=4)
+    ab.params.theta.constrain(0.5)
+    study = run_study(linkage, ['line.a.theta'], np.linspace(0.1, 1.0, 4).reshape(-1,1), max_workers=1)
+    assert study.converged.all()
+    assert np.allclose(study.param_values[:, study.param_names.index('line.a.theta')], np.linspace(0.1, 1.0, 4))
+
+def test_continuation_closes_full_turn():
+    linkage = build_four_bar_linkage(LinkageModel())
+    linkage.update()
+    linkage.get_parameter('line.a.theta').lock()
+    program = linkage.compile()
+    path = linkage.continuation('line.a.theta', 2*np.pi, write_back=False)
+    assert path.reason == 'complete'
+    assert abs(path.t[-1].item()-2*np.pi) < 1.0e-9
+    for values in path.param_values:
+        assert program.residuals(values).abs().max() <= 1.0e-6
+    assert torch.allclose(path.positions[-1], path.positions[0], atol=1.0e-6)
+
+def test_sparse_jacobian_matches_dense():
+    from solver import ProgramProblem
+    program = build_ring_linkage(LinkageModel(), 50).compile()
+    r_sparse, J_sparse = ProgramProblem(program, sparse=True).linearize()
+    r_dense, J_dense = ProgramProblem(program, sparse=False).linearize()
+    assert torch.allclose(r_sparse, r_dense)
+    assert np.allclose(J_sparse.toarray(), J_dense.numpy(), atol=1.0e-12)
+
+def test_large_sparse_ring_converges():
+    linkage = build_ring_linkage(LinkageModel(), 5000)
+    program = linkage.compile()
+    assert program.num_residuals >= 5000 and program.use_sparse_jacobian()
+    result = linkage.update()
+    assert result.converged and result.reason == 'tolerance'
+
+def test_save_load_round_trip(tmp_path):
+    linkage = build_linear_to_angular_linkage(LinkageModel())
+    linkage.update()
+    linkage.get_parameter('line.b.theta').lock()
+    linkage.lines.c.params.theta.constrain(0.5)
+    path = str(tmp_path/'linkage.npz')
+    linkage.save(path)
+    loaded = LinkageModel.load(path)
+    assert list(loaded.points.keys()) == list(linkage.points.keys())
+    assert list(loaded.lines.keys()) == list(linkage.lines.keys())
+    assert torch.equal(loaded.arena.get_values(), linkage.arena.get_values())
+    assert loaded.get_parameter('line.b.theta').locked
+    assert loaded.lines.c.params.theta.target == 0.5
+    program, loaded_program = linkage.compile(), loaded.compile()
+    assert torch.equal(loaded_program.positions(loaded_program.get_values()),
+                       program.positions(program.get_values()))
+
+def test_trajectory_is_continuous():
+    linkage = build_four_bar_linkage(LinkageModel())
+    linkage.update()
+    linkage.get_parameter('line.a.theta').lock()
+    trajectory = linkage.lines.b.p2.trajectory('line.a.theta', num_steps=90)
+    assert trajectory.converged.all()
+    steps = np.linalg.norm(np.diff(trajectory.positions, axis=0), axis=-1)
+    assert steps.max() < 0.5
+    assert np.allclose(trajectory.positions[-1], trajectory.positions[0], atol=1.0e-6)
+    assert np.isclose(trajectory.arc_length[-1], steps.sum())
+
+def test_kinematics_match_finite_differences():
+    linkage = build_four_bar_linkage(LinkageModel())
+    linkage.update()
+    linkage.get_parameter('line.a.theta').lock()
+    program = linkage.compile()
+    d = program.param(linkage.get_parameter('line.a.theta'))
+    targets = torch.linspace(0.3, 1.3, 6, dtype=torch.double)
+    sweep = linkage.sweep('line.a.theta', targets)
+    values = torch.stack([program.solve_dyads(v) for v in sweep.param_values])
+    kinematics = linkage.kinematics('line.a.theta', values)
+    rows = [program.point_rows[name] for name in kinematics.point_names]
+    def get_positions(t):
+        shifted = values.clone()
+        shifted[:, d] = t
+        shifted = torch.stack([program.solve_dyads(v) for v in shifted])
+        return(program.positions(shifted)[:, rows])
+    h = 1.0e-4
+    r, r_plus, r_minus = get_positions(targets), get_positions(targets+h), get_positions(targets-h)
+    assert (kinematics.point_velocities-(r_plus-r_minus)/(2*h)).abs().max() < 1.0e-6
+    assert (kinematics.point_accelerations-(r_plus-2*r+r_minus)/h**2).abs().max() < 1.0e-4
@@ -0,0 +1,34 @@
+import numpy as np
+import torch
+from settings import *
+
+def interpolate_path(t, values, targets):
+    t = t.to(targets.dtype)
+    if len(t) == 1:
+        return(values.expand(len(targets), -1))
+    if t[-1] < t[0]:
+        t, values = t.flip(0), values.flip(0)
+    i = torch.searchsorted(t.contiguous(), targets.contiguous()).clamp(1, len(t)-1)
+    dt = (t[i]-t[i-1]).clamp(min=XTOL)
+    w = ((targets-t[i-1])/dt).clamp(0, 1).unsqueeze(-1).to(values.dtype)
+    return((1-w)*values[i-1]+w*values[i])
+
+def get_arc_length(r):
+    return(np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(r, axis=0), axis=-1))]))
+
+def get_curvature(r, t):
+    if len(r) < 3:
+        return(np.zeros(len(r)))
+    dr = np.gradient(r, t, axis=0)
+    ddr = np.gradient(dr, t, axis=0)
+    speed = np.linalg.norm(dr, axis=-1)
+    cross = np.linalg.norm(np.cross(dr, ddr), axis=-1)
+    return(np.where(speed > XTOL, cross/np.maximum(speed, XTOL)**3, 0.0))
+
+def resample_by_arc_length(r, t, num_steps):
+    s = get_arc_length(r)
+    if s[-1] <= XTOL:
+        return(r[np.linspace(0, len(r)-1, num_steps).round().astype(int)], np.linspace(t[0], t[-1], num_steps))
+    targets = np.linspace(0, s[-1], num_steps)
+    r = np.stack([np.interp(targets, s, r[:, k]) for k in range(r.shape[-1])], axis=-1)
+    return(r, np.interp(targets, s, t))
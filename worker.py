@@ -0,0 +1,56 @@
+import torch, threading
+from munch import Munch
+from settings import *
+from solver import ProgramProblem, levenberg_marquardt
+
+class LatestValue():
+    def __init__(self):
+        self.value = None
+
+    def publish(self, value):
+        self.value = value
+
+    def get(self):
+        return(self.value)
+
+class SolveWorker():
+    def __init__(self, program, values, max_num_iter=LM_MAX_NUM_ITERATIONS, trace=None):
+        self.program = program
+        self.version = program.version
+        self.start_values = values
+        self.max_num_iter = max_num_iter
+        self.trace = trace
+        self.slot = LatestValue()
+        self.cancelled = False
+        self.applied = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    @property
+    def done(self):
+        return(not self.thread.is_alive())
+
+    def start(self):
+        self.thread.start()
+        return(self)
+
+    def run(self):
+        problem = ProgramProblem(self.program, self.start_values.clone())
+        def callback(i, cost):
+            self.slot.publish(Munch(param_values=problem.values, cost=cost, num_iter=i+1,
+                                    done=False, result=None))
+            return(self.cancelled)
+        result = levenberg_marquardt(problem, self.max_num_iter, callback=callback, trace=self.trace)
+        self.slot.publish(Munch(param_values=problem.values, cost=result.cost, num_iter=result.num_iter,
+                                done=True, result=result))
+
+    def cancel(self):
+        self.cancelled = True
+        self.thread.join()
+
+    def join(self, timeout=None):
+        self.thread.join(timeout)
+
+    def get_positions(self, state):
+        with torch.no_grad():
+            r = self.program.positions(state.param_values).numpy()
+        return({name: r[row] for name, row in self.program.point_rows.items()})